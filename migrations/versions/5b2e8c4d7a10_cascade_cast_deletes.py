@@ -0,0 +1,32 @@
+"""cascade cast deletes
+
+Revision ID: 5b2e8c4d7a10
+Revises: 1f151d39a98d
+Create Date: 2026-10-18 09:12:41.503217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8c4d7a10'
+down_revision = '1f151d39a98d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_constraint('casts_movie_id_fkey', 'casts', type_='foreignkey')
+    op.drop_constraint('casts_actor_id_fkey', 'casts', type_='foreignkey')
+    op.create_foreign_key('casts_movie_id_fkey', 'casts', 'movies', ['movie_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('casts_actor_id_fkey', 'casts', 'actors', ['actor_id'], ['id'], ondelete='CASCADE')
+    op.create_index(op.f('ix_casts_actor_id'), 'casts', ['actor_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_casts_actor_id'), table_name='casts')
+    op.drop_constraint('casts_actor_id_fkey', 'casts', type_='foreignkey')
+    op.drop_constraint('casts_movie_id_fkey', 'casts', type_='foreignkey')
+    op.create_foreign_key('casts_actor_id_fkey', 'casts', 'actors', ['actor_id'], ['id'])
+    op.create_foreign_key('casts_movie_id_fkey', 'casts', 'movies', ['movie_id'], ['id'])
@@ -0,0 +1,50 @@
+"""table versions
+
+Revision ID: 8c3f1a6e2b94
+Revises: 5b2e8c4d7a10
+Create Date: 2026-10-18 14:03:27.118452
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c3f1a6e2b94'
+down_revision = '5b2e8c4d7a10'
+branch_labels = None
+depends_on = None
+
+TABLES = ('actors', 'movies', 'casts')
+
+
+def upgrade():
+    op.create_table('table_versions',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.execute('''
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO table_versions (name, version) VALUES (TG_TABLE_NAME, 1)
+        ON CONFLICT (name) DO UPDATE SET version = table_versions.version + 1;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''')
+
+    for table in TABLES:
+        op.execute('''
+        CREATE TRIGGER %(table)s_version
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %(table)s
+        FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()
+        ''' % {'table': table})
+
+
+def downgrade():
+    for table in TABLES:
+        op.execute('DROP TRIGGER %(table)s_version ON %(table)s' % {'table': table})
+
+    op.execute('DROP FUNCTION bump_table_version()')
+    op.drop_table('table_versions')
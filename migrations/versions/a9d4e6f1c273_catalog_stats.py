@@ -0,0 +1,61 @@
+"""catalog stats
+
+Revision ID: a9d4e6f1c273
+Revises: f3a8d52c6e17
+Create Date: 2026-10-18 21:36:12.540871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d4e6f1c273'
+down_revision = 'f3a8d52c6e17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('''
+    CREATE MATERIALIZED VIEW catalog_stats AS
+    SELECT
+        1 AS id,
+        now() AS refreshed_at,
+        (SELECT count(*) FROM movies) AS movies,
+        (SELECT count(*) FROM actors) AS actors,
+        (SELECT count(*) FROM casts) AS casts,
+        (
+            SELECT coalesce(jsonb_object_agg(year, total), '{}')
+            FROM (SELECT year, count(*) AS total FROM movies GROUP BY year) AS years
+        ) AS movies_per_year,
+        (
+            SELECT coalesce(jsonb_object_agg(age_group, total), '{}')
+            FROM (SELECT age / 10 * 10 AS age_group, count(*) AS total FROM actors GROUP BY 1) AS ages
+        ) AS actors_per_age_group,
+        (
+            SELECT coalesce(jsonb_object_agg(gender, total), '{}')
+            FROM (SELECT gender, count(*) AS total FROM actors GROUP BY gender) AS genders
+        ) AS actors_per_gender,
+        (
+            SELECT coalesce(round(avg(size), 2), 0)::float8
+            FROM (
+                SELECT count(casts.id) AS size
+                FROM movies LEFT JOIN casts ON casts.movie_id = movies.id
+                GROUP BY movies.id
+            ) AS sizes
+        ) AS average_cast_size,
+        (
+            SELECT jsonb_build_object(
+                'actors', coalesce(max(version) FILTER (WHERE name = 'actors'), 0),
+                'movies', coalesce(max(version) FILTER (WHERE name = 'movies'), 0),
+                'casts', coalesce(max(version) FILTER (WHERE name = 'casts'), 0)
+            )
+            FROM table_versions
+        ) AS versions
+    ''')
+    op.execute('CREATE UNIQUE INDEX ix_catalog_stats_id ON catalog_stats (id)')
+
+
+def downgrade():
+    op.execute('DROP MATERIALIZED VIEW IF EXISTS catalog_stats')
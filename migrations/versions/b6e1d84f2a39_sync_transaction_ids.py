@@ -0,0 +1,36 @@
+"""sync transaction ids
+
+Revision ID: b6e1d84f2a39
+Revises: a9d4e6f1c273
+Create Date: 2026-10-18 23:12:47.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1d84f2a39'
+down_revision = 'a9d4e6f1c273'
+branch_labels = None
+depends_on = None
+
+TABLES = ('actors', 'movies', 'casts')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('changed_xid', sa.BigInteger(), server_default=sa.text('txid_current()'), nullable=False))
+        op.create_index('ix_%s_changed_xid' % table, table, ['changed_xid', 'id'], unique=False)
+
+    op.add_column('tombstones', sa.Column('deleted_xid', sa.BigInteger(), server_default=sa.text('txid_current()'), nullable=False))
+    op.create_index('ix_tombstones_deleted_xid', 'tombstones', ['table_name', 'deleted_xid', 'row_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tombstones_deleted_xid', table_name='tombstones')
+    op.drop_column('tombstones', 'deleted_xid')
+
+    for table in TABLES:
+        op.drop_index('ix_%s_changed_xid' % table, table_name=table)
+        op.drop_column(table, 'changed_xid')
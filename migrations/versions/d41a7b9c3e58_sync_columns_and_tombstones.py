@@ -0,0 +1,63 @@
+"""sync columns and tombstones
+
+Revision ID: d41a7b9c3e58
+Revises: 8c3f1a6e2b94
+Create Date: 2026-10-18 16:40:09.532781
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41a7b9c3e58'
+down_revision = '8c3f1a6e2b94'
+branch_labels = None
+depends_on = None
+
+TABLES = ('actors', 'movies', 'casts')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+        op.create_index('ix_%s_updated_at' % table, table, ['updated_at', 'id'], unique=False)
+
+    op.create_table('tombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(), nullable=False),
+    sa.Column('row_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tombstones_deleted_at', 'tombstones', ['table_name', 'deleted_at', 'row_id'], unique=False)
+    op.execute('''
+    CREATE OR REPLACE FUNCTION record_tombstone() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO tombstones (table_name, row_id) VALUES (TG_TABLE_NAME, OLD.id);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    ''')
+
+    for table in TABLES:
+        op.execute('''
+        CREATE TRIGGER %(table)s_tombstone
+        AFTER DELETE ON %(table)s
+        FOR EACH ROW EXECUTE PROCEDURE record_tombstone()
+        ''' % {'table': table})
+
+
+def downgrade():
+    for table in TABLES:
+        op.execute('DROP TRIGGER %(table)s_tombstone ON %(table)s' % {'table': table})
+
+    op.execute('DROP FUNCTION record_tombstone()')
+    op.drop_index('ix_tombstones_deleted_at', table_name='tombstones')
+    op.drop_table('tombstones')
+
+    for table in TABLES:
+        op.drop_index('ix_%s_updated_at' % table, table_name=table)
+        op.drop_column(table, 'updated_at')
+        op.drop_column(table, 'created_at')
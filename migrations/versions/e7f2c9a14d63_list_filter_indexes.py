@@ -0,0 +1,32 @@
+"""list filter indexes
+
+Revision ID: e7f2c9a14d63
+Revises: d41a7b9c3e58
+Create Date: 2026-10-18 19:22:51.804413
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7f2c9a14d63'
+down_revision = 'd41a7b9c3e58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_movies_year', 'movies', ['year', 'id'], unique=False)
+    op.create_index('ix_movies_name', 'movies', ['name', 'id'], unique=False)
+    op.create_index('ix_actors_age', 'actors', ['age', 'id'], unique=False)
+    op.create_index('ix_actors_gender_age', 'actors', ['gender', 'age', 'id'], unique=False)
+    op.create_index('ix_actors_name', 'actors', ['name', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_actors_name', table_name='actors')
+    op.drop_index('ix_actors_gender_age', table_name='actors')
+    op.drop_index('ix_actors_age', table_name='actors')
+    op.drop_index('ix_movies_name', table_name='movies')
+    op.drop_index('ix_movies_year', table_name='movies')
@@ -0,0 +1,46 @@
+"""name search
+
+Revision ID: f3a8d52c6e17
+Revises: e7f2c9a14d63
+Create Date: 2026-10-18 20:41:07.318925
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8d52c6e17'
+down_revision = 'e7f2c9a14d63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pg_trgm needs the contrib package, search falls back to an in-process index without it
+    op.execute('''
+    DO $$
+    BEGIN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    EXCEPTION WHEN OTHERS THEN
+        RAISE NOTICE 'pg_trgm is not available, search uses the in-process index';
+    END
+    $$
+    ''')
+
+    for table in ('actors', 'movies'):
+        op.execute('''
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX ix_%(table)s_name_trgm ON %(table)s USING gist (name gist_trgm_ops);
+            END IF;
+        END
+        $$
+        ''' % {'table': table})
+
+
+def downgrade():
+    # The extension is left in place, other database objects may use it
+    op.execute('DROP INDEX IF EXISTS ix_movies_name_trgm')
+    op.execute('DROP INDEX IF EXISTS ix_actors_name_trgm')
@@ -1,6 +1,7 @@
 #!/bin/bash
 export DATABASE_URL="postgresql://postgres@localhost:5432/fsnd"
 export FLASK_ENV=development
+export DEBUG=true
 export FLASK_APP=src/app.py
 export AUTH0_DOMAIN="https://udc-casting-agency.us.auth0.com/.well-known/jwks.json"
 export AUTH0_AUDIENCE="udc-casting-agency"
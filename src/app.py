@@ -1,9 +1,43 @@
-from flask import Flask, abort, jsonify, request
+import os
+import io
+import csv
+import json
+import time
+import hashlib
+import operator
+import base64
+import binascii
+from datetime import datetime, timezone
+from functools import wraps
+from dateutil.parser import isoparse
+from flask import Flask, Response, abort, g, request, stream_with_context
 from flask_cors import CORS
-from .database.models import setup_db, Actor, Movie
-from .auth.auth0 import AuthError, requires_auth
-
-PAGINATE = 3
+from sqlalchemy import Integer, and_, or_, func, literal, select, tuple_, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import aliased, selectinload
+from .database.models import setup_db, db, save, pool_stats, record_change, on_change, table_versions, has_extension, Actor, Movie, Cast, Tombstone
+from .database.models import use_replica, replica_stats, sync_bound, DB_READ_YOUR_WRITES
+from .database.models import catalog_stats, refresh_catalog_stats, STATS_TABLES
+from .database.models import parse_fields, project, FIELDS
+from .database.models import begin_unit_of_work, end_unit_of_work, reset_unit_of_work, commit_count
+from .auth.auth0 import AuthError, requires_auth, check_permissions, token_subject, jwks_store, token_cache
+from .cache.response_cache import response_cache
+from .feed.change_feed import change_feed, FEED_HEARTBEAT
+from .search.name_index import TableNameIndex
+from .serialization.json_provider import jsonify, make_provider
+from .graph.costar_graph import TableCastGraph
+
+PAGINATE = int(os.environ.get('PAGINATE', 3))
+PAGINATE_MAX = int(os.environ.get('PAGINATE_MAX', 100))
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', 50000))
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+IDS_MAX = int(os.environ.get('IDS_MAX', 1000))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+SEARCH_MAX_LENGTH = int(os.environ.get('SEARCH_MAX_LENGTH', 100))
+GRAPH_MAX_DEPTH = int(os.environ.get('GRAPH_MAX_DEPTH', 6))
+GRAPH_TIMEOUT = float(os.environ.get('GRAPH_TIMEOUT', 1))
+STATS_MAX_AGE = int(os.environ.get('STATS_MAX_AGE', 60))
 
 '''
 App creation
@@ -15,42 +49,944 @@ def create_app():
 
     app = Flask(__name__, instance_relative_config=True)
     setup_db(app)
+    app.config['STATS_MAX_AGE'] = STATS_MAX_AGE
+    app.extensions['json_provider'] = make_provider(sort_keys=app.config['JSON_SORT_KEYS'])
     CORS(app, resources={r"*": {"origins": "*"}})
+    jwks_store.start_background_refresh()
+    on_change(response_cache.invalidate)
+    on_change(change_feed.publish)
+    change_feed.start(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    @app.after_request
+    def after_request(response):
+        response.headers.add(
+            "Access-Control-Allow-Headers", "Content-Type,Authorization,true"
+        )
+        response.headers.add(
+            "Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS"
+        )
+
+        return response
+
+    '''
+    Request transaction
+    Handlers only flush, the request commits once when it
+    succeeds and rolls back otherwise
+
+    '''
+    @app.before_request
+    def begin_transaction():
+        begin_unit_of_work()
+
+    @app.after_request
+    def end_transaction(response):
+        end_unit_of_work(commit=response.status_code < 400)
+        response.headers['X-DB-Commits'] = str(commit_count())
+
+        return response
+
+    @app.teardown_request
+    def reset_transaction(error):
+        reset_unit_of_work()
+
+    '''
+    Read replicas
+    Reads go to a replica unless the client wrote recently. Writes
+    pin the token's subject to the primary for a few seconds, in the
+    response cache backend so every worker knows, and browsers on the
+    same origin also get a cookie
+
+    '''
+    PRIMARY_COOKIE = 'db_primary_until'
+
+    def primary_pin(subject):
+        return 'primary:' + subject
+
+    @app.before_request
+    def route_reads():
+        if request.method not in ('GET', 'HEAD') or 'replicas' not in app.extensions:
+            return
+
+        pinned_until = request.cookies.get(PRIMARY_COOKIE, 0, type=float)
+
+        if pinned_until >= time.time():
+            return
+
+        subject = token_subject()
+
+        if subject is None or not response_cache.flagged(primary_pin(subject)):
+            use_replica(app)
+
+    @app.after_request
+    def pin_writes(response):
+        if request.method in ('POST', 'PATCH', 'PUT', 'DELETE') and response.status_code < 400:
+            if DB_READ_YOUR_WRITES > 0 and 'replicas' in app.extensions:
+                subject = token_subject()
+
+                if subject is not None:
+                    response_cache.flag(primary_pin(subject), DB_READ_YOUR_WRITES)
+
+                pinned_until = time.time() + DB_READ_YOUR_WRITES
+                response.set_cookie(PRIMARY_COOKIE, str(pinned_until), max_age=DB_READ_YOUR_WRITES, httponly=True)
+
+        return response
+
+    '''
+    Pagination
+
+    '''
+    def page_size(request):
+        limit = request.args.get('limit', PAGINATE, type=int)
+
+        if limit < 1:
+            abort(400)
+
+        return min(limit, PAGINATE_MAX)
+
+    def paginate(request, query, format_row):
+        page = request.args.get('page', 1, type=int)
+
+        if page < 1:
+            return []
+
+        limit = page_size(request)
+        selection = query.limit(limit).offset((page - 1) * limit).all()
+
+        return [format_row(item) for item in selection]
+
+    def count(model, conditions=()):
+        return db.session.query(func.count(model.id)).filter(*conditions).scalar()
+
+    '''
+    Keyset pagination
+    Opaque cursors carry the last id of a page, so the next
+    page is an index range scan instead of an OFFSET skip
+
+    '''
+    def encode_cursor(values):
+        cursor = base64.urlsafe_b64encode(json.dumps(values).encode())
+
+        return cursor.decode().rstrip('=')
+
+    def decode_cursor(cursor):
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+
+        except (ValueError, binascii.Error):
+            abort(400)
+
+        if not isinstance(values, dict) or not isinstance(values.get('id'), int):
+            abort(400)
+
+        return values
+
+    def paginate_after(request, query, model, format_row, sort='id', order='desc'):
+        cursor = request.args.get('after')
+        limit = page_size(request)
+        column = SORTS[model][sort]
+
+        if cursor:
+            position = decode_cursor(cursor)
+
+            if position.get('sort', 'id') != sort:
+                abort(400)
+
+            if sort == 'id':
+                key, last = model.id, position['id']
+
+            else:
+                value = position.get('value')
+
+                if not isinstance(value, (int, str)) or isinstance(value, bool):
+                    abort(400)
+
+                key, last = tuple_(column, model.id), tuple_(value, position['id'])
+
+            query = query.filter(key < last if order == 'desc' else key > last)
+
+        selection = query.limit(limit + 1).all()
+        next_cursor = None
+
+        if len(selection) > limit:
+            selection = selection[:limit]
+            position = {'id': selection[-1].id}
+
+            if sort != 'id':
+                position.update({'sort': sort, 'value': getattr(selection[-1], column.key)})
+
+            next_cursor = encode_cursor(position)
+
+        return [format_row(item) for item in selection], next_cursor
+
+    def wants_total(request):
+        return request.args.get('total', '').lower() in ('1', 'true', 'yes')
+
+    '''
+    Filtering and sorting
+    ?year_min=, ?age_max=, ?gender= narrow a list and ?sort=name&order=desc
+    orders it. Every combination has a composite index ending in id,
+    which also breaks ties for the keyset cursor
+
+    '''
+    RANGES = {
+        Actor: {'age_min': (Actor.age, operator.ge), 'age_max': (Actor.age, operator.le)},
+        Movie: {'year_min': (Movie.year, operator.ge), 'year_max': (Movie.year, operator.le)}
+    }
+
+    SORTS = {
+        Actor: {'id': Actor.id, 'name': Actor.name, 'age': Actor.age},
+        Movie: {'id': Movie.id, 'name': Movie.name, 'year': Movie.year}
+    }
+
+    def list_filters(request, model):
+        conditions = []
+
+        for name, (column, compare) in RANGES[model].items():
+            if name in request.args:
+                value = request.args.get(name, type=int)
+
+                if value is None:
+                    abort(400)
+
+                conditions.append(compare(column, value))
+
+        if model is Actor and 'gender' in request.args:
+            gender = request.args.get('gender')
+
+            if len(gender) != 1:
+                abort(400)
+
+            conditions.append(Actor.gender == gender)
+
+        return conditions
+
+    def list_order(request, model):
+        sort = request.args.get('sort', 'id')
+        order = request.args.get('order', 'desc' if sort == 'id' else 'asc')
+
+        if sort not in SORTS[model] or order not in ('asc', 'desc'):
+            abort(400)
+
+        return sort, order
+
+    def order_list(query, model, sort, order):
+        columns = [SORTS[model][sort], model.id] if sort != 'id' else [model.id]
+
+        if order == 'desc':
+            columns = [column.desc() for column in columns]
+
+        return query.order_by(*columns)
+
+    '''
+    Incremental sync
+    ?since=<ISO timestamp> returns the rows changed and the ids deleted
+    after that point, in the order of the transactions that wrote them.
+    Both come from one UNION over the changed_xid and tombstone indexes,
+    so a page costs the same however large the table is. next_cursor
+    carries the position to resume from. A page stops at the sync bound,
+    rows past it may still have an unfinished transaction behind them;
+    a page cut there is neither cached nor tagged and reads again next time
+
+    '''
+    def parse_timestamp(value):
+        # datetime.fromisoformat only takes a trailing 'Z' from Python 3.11
+        try:
+            timestamp = isoparse(value)
+
+        except (TypeError, ValueError):
+            abort(400)
+
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+
+        return timestamp
+
+    def sync_page(request, query, model, format_row):
+        table = model.__table__
+        tombstones = Tombstone.__table__
+        limit = page_size(request)
+        bound = sync_bound()
+
+        changed = select(table.c.id, table.c.changed_xid.label('xid'), literal(False).label('deleted'))
+        deleted = select(tombstones.c.row_id, tombstones.c.deleted_xid, literal(True)) \
+            .where(tombstones.c.table_name == table.name)
+
+        cursor = request.args.get('after')
+        since = request.args.get('since')
+
+        if cursor:
+            position = decode_cursor(cursor)
+
+            if not isinstance(position.get('xid'), int):
+                abort(400)
+
+            changed = changed.where(tuple_(table.c.changed_xid, table.c.id) > tuple_(position['xid'], position['id']))
+            deleted = deleted.where(
+                tuple_(tombstones.c.deleted_xid, tombstones.c.row_id) > tuple_(position['xid'], position['id'])
+            )
+
+        elif since:
+            changed_at = parse_timestamp(since)
+            changed = changed.where(table.c.updated_at > changed_at)
+            deleted = deleted.where(tombstones.c.deleted_at > changed_at)
+
+        changes = union_all(changed, deleted).subquery()
+        selection = db.session.execute(
+            select(changes).order_by(changes.c.xid, changes.c.id).limit(limit + 1)
+        ).all()
+
+        settled = [row for row in selection if row.xid < bound]
+
+        # Committed rows past the bound come back once the older transactions finish
+        if len(settled) < len(selection) and len(settled) <= limit:
+            g.partial_response = True
+
+        has_more = len(settled) > limit
+        selection = settled[:limit]
+        ids = [row.id for row in selection if not row.deleted]
+        found = {item.id: item for item in query.filter(model.id.in_(ids))} if ids else {}
+        next_cursor = cursor
+
+        if selection:
+            last = selection[-1]
+            next_cursor = encode_cursor({'xid': last.xid, 'id': last.id})
+
+        return {
+            'changed': [format_row(found[row_id]) for row_id in ids if row_id in found],
+            'deleted': [row.id for row in selection if row.deleted],
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }
+
+    def synced(format_row):
+        def format_synced(item):
+            row = format_row(item)
+            row['updated_at'] = item.updated_at.isoformat()
+
+            return row
+
+        return format_synced
+
+    '''
+    Multi-get
+    ?ids=1,2,3 resolves a set of ids with one IN query, keeps the
+    requested order and reports the ids that don't exist
+
+    '''
+    def parse_ids(request):
+        try:
+            ids = [int(item) for item in request.args.get('ids', '').split(',') if item.strip()]
+
+        except ValueError:
+            abort(400)
+
+        if len(ids) == 0 or len(ids) > IDS_MAX:
+            abort(400)
+
+        return list(dict.fromkeys(ids))
+
+    def fetch_many(request, query, model, format_row):
+        ids = parse_ids(request)
+        found = {item.id: item for item in query.filter(model.id.in_(ids))}
+        selection = [format_row(found[item_id]) for item_id in ids if item_id in found]
+        missing = [item_id for item_id in ids if item_id not in found]
+
+        return selection, missing
+
+    '''
+    Related entities
+    ?include=cast embeds the cast of a movie or the movies of
+    an actor, loaded with one extra query for the whole page
+
+    '''
+    def include_cast(request):
+        include = set(filter(None, request.args.get('include', '').split(',')))
+
+        if include - {'cast'}:
+            abort(400)
+
+        return 'cast' in include
+
+    def load_cast(query, model):
+        related = Cast.actors if model is Movie else Cast.movies
+
+        return query.options(selectinload(model.casting).joinedload(related))
+
+    '''
+    Sparse fieldsets
+    ?fields=name,year trims both the SELECT and the payload. Without
+    ?include=cast lists read plain rows through a projection, with it
+    they still need the ORM to load the related entities
+
+    '''
+    def field_names(request, model):
+        if 'fields' not in request.args:
+            return None
+
+        try:
+            return parse_fields(model, request.args.get('fields').split(','))
+
+        except ValueError:
+            abort(400)
+
+    def entity_format(cast, names):
+        if names is None:
+            return lambda item: item.format(cast=cast)
+
+        keep = set(names) | {'cast', 'movies'}
+
+        return lambda item: {key: value for key, value in item.format(cast=cast).items() if key in keep}
+
+    def read_selection(model, cast, names, extra=()):
+        if cast:
+            return load_cast(model.query, model), entity_format(cast, names)
+
+        names = names or list(FIELDS[model])
+
+        return project(model, names, extra), lambda row: dict(zip(names, row))
+
+    '''
+    Bulk creation
+    Accepts a JSON array or NDJSON, validates the whole batch
+    and inserts it with one multi-row INSERT per chunk
+
+    '''
+    def parse_batch(request):
+        if request.mimetype == 'application/x-ndjson':
+            try:
+                lines = request.get_data(as_text=True).splitlines()
+                rows = [json.loads(line) for line in lines if line.strip()]
+
+            except ValueError:
+                abort(400)
+
+        else:
+            rows = request.get_json(silent=True)
+
+        if not isinstance(rows, list) or len(rows) == 0:
+            abort(400)
+
+        if len(rows) > BULK_MAX_ROWS:
+            abort(413)
+
+        return rows
+
+    def is_integer(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def validate_actor(row):
+        if not isinstance(row, dict):
+            return None, 'actor must be an object'
+
+        if not isinstance(row.get('name'), str) or not row['name'].strip():
+            return None, 'name is required'
+
+        if not is_integer(row.get('age')) or row['age'] < 0:
+            return None, 'age must be a positive integer'
+
+        if not isinstance(row.get('gender'), str) or len(row['gender']) != 1:
+            return None, 'gender must be a single character'
+
+        return {'name': row['name'], 'age': row['age'], 'gender': row['gender']}, None
+
+    def validate_movie(row):
+        if not isinstance(row, dict):
+            return None, 'movie must be an object'
+
+        if not isinstance(row.get('name'), str) or not row['name'].strip():
+            return None, 'name is required'
+
+        if not is_integer(row.get('year')):
+            return None, 'year must be an integer'
+
+        return {'name': row['name'], 'year': row['year']}, None
+
+    def bulk_create(request, model, validate):
+        rows = parse_batch(request)
+        partial = request.args.get('mode', 'atomic') == 'partial'
+        values = []
+        positions = []
+        errors = []
+
+        for index, row in enumerate(rows):
+            value, error = validate(row)
+
+            if error:
+                errors.append({'index': index, 'message': error})
+
+            else:
+                values.append(value)
+                positions.append(index)
+
+        if errors and not partial:
+            return jsonify({
+                'success': False,
+                'error': 422,
+                'message': 'unprocessable',
+                'errors': errors
+            }), 422
+
+        ids = [None] * len(rows)
+        table = model.__table__
+
+        try:
+            for start in range(0, len(values), BULK_CHUNK_SIZE):
+                chunk = values[start:start + BULK_CHUNK_SIZE]
+                statement = table.insert().values(chunk).returning(table.c.id)
+                created = db.session.execute(statement).scalars().all()
+
+                for position, created_id in zip(positions[start:], created):
+                    ids[position] = created_id
+
+                record_change(table.name, 'insert', created)
+
+            save()
+
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'created': len(values),
+            'ids': ids,
+            'errors': errors
+        })
+
+    '''
+    Set-based writes
+    PATCH and DELETE run one UPDATE/DELETE ... RETURNING and
+    decide 404 from the affected rows, without loading them first.
+    Casts are removed by the ON DELETE CASCADE foreign keys
+
+    '''
+    def update_rows(model, condition, changes):
+        table = model.__table__
+
+        if changes:
+            statement = table.update() \
+                .where(condition) \
+                .values(**changes) \
+                .returning(table.c.id)
+
+        else:
+            statement = select(table.c.id).where(condition)
+
+        try:
+            updated = db.session.execute(statement).scalars().all()
+
+            if changes:
+                record_change(table.name, 'update', updated)
+
+            save()
+
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
+
+        return sorted(updated)
+
+    def delete_rows(model, condition):
+        table = model.__table__
+        statement = table.delete().where(condition).returning(table.c.id)
+
+        try:
+            deleted = db.session.execute(statement).scalars().all()
+            record_change(table.name, 'delete', deleted)
+
+            if deleted and model is not Cast:
+                record_change(Cast.__tablename__, 'delete')
+
+            save()
+
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
+
+        return sorted(deleted)
+
+    def update_row(model, row_id, changes):
+        updated = update_rows(model, model.id == row_id, changes)
+
+        return updated[0] if updated else None
+
+    def delete_row(model, row_id):
+        deleted = delete_rows(model, model.id == row_id)
+
+        return deleted[0] if deleted else None
+
+    def actor_changes(body):
+        changes = {}
+
+        try:
+            if 'name' in body:
+                changes['name'] = str(body.get('name'))
+
+            if 'age' in body:
+                changes['age'] = int(body.get('age'))
+
+            if 'gender' in body:
+                changes['gender'] = str(body.get('gender'))
+
+        except (TypeError, ValueError):
+            abort(400)
+
+        return changes
+
+    def movie_changes(body):
+        changes = {}
+
+        try:
+            if 'name' in body:
+                changes['name'] = str(body.get('name'))
+
+            if 'release' in body:
+                changes['year'] = int(body.get('release'))
+
+        except (TypeError, ValueError):
+            abort(400)
+
+        return changes
+
+    '''
+    Filter expressions
+    Bulk writes select their rows with either an id list or
+    a filter such as {"release": {"gte": 1990, "lt": 2000}}
+
+    '''
+    OPERATORS = {
+        'eq': operator.eq,
+        'ne': operator.ne,
+        'lt': operator.lt,
+        'lte': operator.le,
+        'gt': operator.gt,
+        'gte': operator.ge
+    }
+
+    # Same types as validate_actor and validate_movie, so Postgres never sees a bad cast
+    def valid_operand(column, operand):
+        if isinstance(column.type, Integer):
+            return is_integer(operand)
+
+        return isinstance(operand, str)
+
+    def build_filter(model, expression):
+        if not isinstance(expression, dict) or len(expression) == 0:
+            abort(400)
+
+        conditions = []
+
+        for field, value in expression.items():
+            column = FIELDS[model].get(field)
+
+            if column is None:
+                abort(400)
+
+            comparisons = value if isinstance(value, dict) else {'eq': value}
+
+            if len(comparisons) == 0:
+                abort(400)
+
+            for name, operand in comparisons.items():
+                if name == 'in' and isinstance(operand, list) and all(valid_operand(column, item) for item in operand):
+                    conditions.append(column.in_(operand))
+
+                elif name in OPERATORS and valid_operand(column, operand):
+                    conditions.append(OPERATORS[name](column, operand))
+
+                else:
+                    abort(400)
+
+        return and_(*conditions)
+
+    def bulk_condition(body, model):
+        ids = body.get('ids')
+        expression = body.get('filter')
+
+        if (ids is None) == (expression is None):
+            abort(400)
+
+        if expression is not None:
+            return build_filter(model, expression)
+
+        if not isinstance(ids, list) or len(ids) == 0 or len(ids) > BULK_MAX_ROWS:
+            abort(400)
+
+        if not all(is_integer(row_id) for row_id in ids):
+            abort(400)
+
+        return model.id.in_(ids)
+
+    def parse_bulk_body(request):
+        body = request.get_json(silent=True)
+
+        if not isinstance(body, dict):
+            abort(400)
+
+        return body
+
+    '''
+    Casting
+    Actor ids are sent as a list and written with a single
+    statement, never one SELECT and commit per pair
+
+    '''
+    def parse_actor_ids(request):
+        body = request.get_json(silent=True)
+
+        if not isinstance(body, dict):
+            abort(400)
+
+        actor_ids = body.get('actors')
+
+        if not isinstance(actor_ids, list) or len(actor_ids) == 0:
+            abort(400)
+
+        if not all(is_integer(actor_id) for actor_id in actor_ids):
+            abort(400)
+
+        if len(actor_ids) > BULK_MAX_ROWS:
+            abort(413)
+
+        return list(dict.fromkeys(actor_ids))
+
+    def movie_exists(movie_id):
+        return db.session.query(Movie.id).filter(Movie.id == movie_id).scalar() is not None
+
+    '''
+    Search
+    With pg_trgm, ?q= is a nearest neighbour scan of the GiST index
+    ordered by word distance, so a typeahead reads only the rows it
+    returns. Without the extension an in-process index answers instead
+
+    '''
+    SEARCHES = {'actors': Actor, 'movies': Movie}
+    fallback_indexes = {name: TableNameIndex(model) for name, model in SEARCHES.items()}
+    search_engine = {}
+
+    def trigram_available():
+        if 'trigram' not in search_engine:
+            search_engine['trigram'] = has_extension('pg_trgm')
+
+        return search_engine['trigram']
+
+    def escape_like(value):
+        return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    def trigram_search(model, query, prefix, limit):
+        distance = literal(query).op('<<->')(model.name)
+
+        if prefix:
+            pattern = escape_like(query)
+            condition = or_(
+                model.name.ilike(pattern + '%', escape='\\'),
+                model.name.ilike('% ' + pattern + '%', escape='\\')
+            )
+
+        else:
+            condition = literal(query).op('<%')(model.name)
+
+        return model.query.filter(condition).order_by(distance, model.id).limit(limit).all()
+
+    def fallback_search(name, model, query, prefix, limit):
+        ids = fallback_indexes[name].search(query, prefix, limit)
+        found = {item.id: item for item in model.query.filter(model.id.in_(ids))} if ids else {}
+
+        return [found[item_id] for item_id in ids if item_id in found]
+
+    '''
+    Co-stars
+    Shared movies are counted with one self-join of casts, paths
+    between actors come from an in-process copy of the cast graph
+
+    '''
+    cast_graph = TableCastGraph(Cast)
+
+    def actor_exists(actor_id):
+        return db.session.query(Actor.id).filter(Actor.id == actor_id).scalar() is not None
+
+    def costars(actor_id):
+        mine = aliased(Cast)
+        theirs = aliased(Cast)
+        shared = func.count(theirs.movie_id).label('shared')
+
+        return db.session.query(Actor, shared) \
+            .join(theirs, theirs.actor_id == Actor.id) \
+            .join(mine, and_(mine.movie_id == theirs.movie_id, mine.actor_id == actor_id)) \
+            .filter(Actor.id != actor_id) \
+            .group_by(Actor.id) \
+            .order_by(shared.desc(), Actor.id)
+
+    def load_path(ids):
+        actor_ids, movie_ids = ids[0::2], ids[1::2]
+        actors = {actor.id: actor for actor in Actor.query.filter(Actor.id.in_(actor_ids))}
+        movies = {movie.id: movie for movie in Movie.query.filter(Movie.id.in_(movie_ids))} if movie_ids else {}
+
+        # A row deleted since the graph was refreshed, the path is stale
+        if len(actors) < len(set(actor_ids)) or len(movies) < len(set(movie_ids)):
+            return None
+
+        return [actors[actor_id].format() for actor_id in actor_ids], [movies[movie_id].format() for movie_id in movie_ids]
+
+    '''
+    Catalog statistics
+    Served from the catalog_stats view. A request that finds it behind
+    the tables and older than STATS_MAX_AGE refreshes it first, so
+    answers are never staler than that while writes keep coming
+
+    '''
+    def stats_changed(stats):
+        return stats['versions'] != dict(zip(STATS_TABLES, table_versions(STATS_TABLES)))
+
+    def stats_age(stats):
+        return (datetime.now(timezone.utc) - stats['refreshed_at']).total_seconds()
+
+    '''
+    Streaming export
+    Plain rows come from a server-side cursor in batches of
+    EXPORT_BATCH_SIZE, so worker memory stays flat
+
+    '''
+    def export(request, model):
+        export_format = request.args.get('format', 'ndjson')
+        names = field_names(request, model) or list(FIELDS[model])
+        selection = project(model, names).order_by(model.id) \
+            .execution_options(stream_results=True).yield_per(EXPORT_BATCH_SIZE)
+
+        if export_format == 'ndjson':
+            mimetype = 'application/x-ndjson'
+            dumps = app.extensions['json_provider'].dumps
+
+            def generate():
+                lines = []
+
+                for row in selection:
+                    lines.append(dumps(dict(zip(names, row))))
+
+                    if len(lines) == EXPORT_BATCH_SIZE:
+                        yield b'\n'.join(lines) + b'\n'
+                        lines = []
+
+                if lines:
+                    yield b'\n'.join(lines) + b'\n'
+
+        elif export_format == 'csv':
+            mimetype = 'text/csv'
+
+            def generate():
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(names)
+                rows = 0
+
+                for row in selection:
+                    writer.writerow(row)
+                    rows += 1
+
+                    if rows % EXPORT_BATCH_SIZE == 0:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+
+                yield buffer.getvalue()
+
+        else:
+            abort(400)
+
+        return Response(stream_with_context(generate()), mimetype=mimetype)
+
+    '''
+    Response cache
+    GET responses are kept as rendered JSON, tagged with the tables
+    and rows they read. ?include=cast also reads the related tables.
+    Bodies read from a replica are also keyed by that replica's
+    table versions, so they can't outlive its replication lag
+
+    '''
+    def cached(*tags, include=()):
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if not response_cache.enabled:
+                    return f(*args, **kwargs)
+
+                depends = [tag.format(**kwargs) for tag in tags]
+
+                if 'include' in request.args:
+                    depends.extend(include)
+
+                # The backend versions move when the primary commits, a lagging replica
+                # has not caught up yet. Its own table versions keep its bodies apart
+                replica = []
+
+                if g.get('db_replica') is not None:
+                    tables = sorted(set(tag.split(':')[0] for tag in depends))
+                    replica = list(zip(tables, table_versions(tables)))
+
+                key = response_cache.key(request.path, request.args.items(multi=True), depends, replica)
+
+                if key is None:
+                    return f(*args, **kwargs)
+
+                body = response_cache.get(key)
+
+                if body is not None:
+                    response = app.response_class(body, mimetype='application/json')
+                    response.headers['X-Cache'] = 'HIT'
+
+                    return response
+
+                response = app.make_response(f(*args, **kwargs))
+
+                if response.status_code == 200 and not g.get('partial_response'):
+                    response_cache.put(key, response.get_data())
+
+                response.headers['X-Cache'] = 'MISS'
 
-    @app.after_request
-    def after_request(response):
-        response.headers.add(
-            "Access-Control-Allow-Headers", "Content-Type,Authorization,true"
-        )
-        response.headers.add(
-            "Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS"
-        )
+                return response
 
-        return response
+            return wrapper
+
+        return decorator
 
     '''
-    Pagination
+    Conditional requests
+    The ETag comes from the version counters of the tables a
+    response reads, so a matching If-None-Match returns 304
+    after one small lookup, before any row is loaded
 
     '''
-    def paginate_actors(request, selection):
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * PAGINATE
-        end = start + PAGINATE
+    def conditional(*tables, include=()):
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                depends = list(tables)
 
-        actors = [actor.format() for actor in selection]
-        current_actors = actors[start:end]
+                if 'include' in request.args:
+                    depends.extend(include)
 
-        return current_actors
+                versions = table_versions(depends)
+                query = sorted(request.args.items(multi=True))
+                raw = json.dumps([request.path, query, list(zip(depends, versions))])
+                etag = hashlib.sha1(raw.encode()).hexdigest()
 
-    def paginate_movies(request, selection):
-        page = request.args.get('page', 1, type=int)
-        start = (page - 1) * PAGINATE
-        end = start + PAGINATE
+                if request.if_none_match.contains_weak(etag):
+                    response = app.response_class(status=304)
+
+                else:
+                    response = app.make_response(f(*args, **kwargs))
+
+                    if response.status_code != 200 or g.get('partial_response'):
+                        return response
+
+                response.set_etag(etag)
 
-        movies = [movie.format() for movie in selection]
-        current_movies = movies[start:end]
+                return response
 
-        return current_movies
+            return wrapper
+
+        return decorator
 
     '''
     Home with Hello Reviewer
@@ -60,15 +996,74 @@ def create_app():
     def index():
         return "Hello FSND Reviewer! :)"
 
+    '''
+    Health with pool and cache statistics for monitoring
+
+    '''
+    @app.route('/health')
+    def health():
+        return jsonify({
+            'success': True,
+            'database': pool_stats(),
+            'replicas': replica_stats(app),
+            'tokens': token_cache.stats(),
+            'cache': response_cache.stats(),
+            'feed': change_feed.stats()
+        })
+
     '''
     Actors endpoints
 
     '''
     @app.route('/actors')
     @requires_auth('get:actors')
+    @conditional('actors', include=('casts', 'movies'))
+    @cached('actors', include=('casts', 'movies'))
     def list_actors(payload):
-        selection = Actor.query.order_by(Actor.id.desc()).all()
-        current_actors = paginate_actors(request, selection)
+        cast = include_cast(request)
+        names = field_names(request, Actor)
+
+        if 'since' in request.args:
+            selection = load_cast(Actor.query, Actor) if cast else Actor.query
+            page = sync_page(request, selection, Actor, synced(entity_format(cast, names)))
+
+            return jsonify({
+                'success': True,
+                'actors': page['changed'],
+                'deleted': page['deleted'],
+                'next_cursor': page['next_cursor'],
+                'has_more': page['has_more']
+            })
+
+        if 'ids' in request.args:
+            selection, format_row = read_selection(Actor, cast, names)
+            current_actors, missing = fetch_many(request, selection, Actor, format_row)
+
+            return jsonify({
+                'success': True,
+                'actors': current_actors,
+                'missing': missing
+            })
+
+        conditions = list_filters(request, Actor)
+        sort, order = list_order(request, Actor)
+        selection, format_row = read_selection(Actor, cast, names, [SORTS[Actor][sort]])
+        selection = order_list(selection.filter(*conditions), Actor, sort, order)
+
+        if 'after' in request.args:
+            current_actors, next_cursor = paginate_after(request, selection, Actor, format_row, sort, order)
+            result = {
+                'success': True,
+                'actors': current_actors,
+                'next_cursor': next_cursor
+            }
+
+            if wants_total(request):
+                result['total_actors'] = count(Actor, conditions)
+
+            return jsonify(result)
+
+        current_actors = paginate(request, selection, format_row)
 
         if len(current_actors) == 0:
             abort(404)
@@ -76,20 +1071,77 @@ def create_app():
         return jsonify({
             'success': True,
             'actors': current_actors,
-            'total_actors': len(Actor.query.all())
+            'total_actors': count(Actor, conditions)
         })
 
     @app.route('/actors/<int:actor_id>', methods=['GET'])
     @requires_auth('get:actors')
+    @conditional('actors', include=('casts', 'movies'))
+    @cached('actors:{actor_id}', 'actors:*', include=('casts', 'movies'))
     def get_actor(payload, actor_id):
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+        cast = include_cast(request)
+        selection = Actor.query.filter(Actor.id == actor_id)
+
+        if cast:
+            selection = load_cast(selection, Actor)
+
+        actor = selection.one_or_none()
 
         if actor is None:
             abort(404)
 
         return jsonify({
             'success': True,
-            'actor': actor.format()
+            'actor': actor.format(cast=cast)
+        })
+
+    @app.route('/actors/<int:actor_id>/costars')
+    @requires_auth('get:actors')
+    @conditional('actors', 'casts')
+    @cached('actors', 'casts')
+    def get_costars(payload, actor_id):
+        if not actor_exists(actor_id):
+            abort(404)
+
+        page = request.args.get('page', 1, type=int)
+
+        if page < 1:
+            abort(400)
+
+        limit = page_size(request)
+        selection = costars(actor_id).limit(limit).offset((page - 1) * limit)
+
+        return jsonify({
+            'success': True,
+            'actorId': actor_id,
+            'costars': [dict(actor.format(), sharedMovies=shared) for actor, shared in selection]
+        })
+
+    @app.route('/actors/<int:source_id>/path/<int:target_id>')
+    @requires_auth('get:actors')
+    def get_path(payload, source_id, target_id):
+        check_permissions('get:movies', payload)
+
+        max_depth = request.args.get('max_depth', GRAPH_MAX_DEPTH, type=int)
+
+        if max_depth < 1:
+            abort(400)
+
+        if not actor_exists(source_id) or not actor_exists(target_id):
+            abort(404)
+
+        ids, truncated = cast_graph.path(source_id, target_id, min(max_depth, GRAPH_MAX_DEPTH), GRAPH_TIMEOUT)
+        found = load_path(ids) if ids is not None else None
+        actors, movies = found if found is not None else (None, None)
+
+        return jsonify({
+            'success': True,
+            'from': source_id,
+            'to': target_id,
+            'degrees': len(movies) if movies is not None else None,
+            'actors': actors,
+            'movies': movies,
+            'truncated': truncated
         })
 
     @app.route('/actors', methods=['POST'])
@@ -113,57 +1165,64 @@ def create_app():
         except():
             abort(422)
 
+    @app.route('/actors/bulk', methods=['POST'])
+    @requires_auth('post:actors')
+    def new_actors(payload):
+        return bulk_create(request, Actor, validate_actor)
+
     @app.route('/actors/<int:actor_id>', methods=['DELETE'])
     @requires_auth('delete:actors')
     def delete_actor(payload, actor_id):
-        try:
-            actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
-
-            if actor is None:
-                abort(404)
-
-            actor.delete()
-
-            return jsonify({
-                'success': True,
-                'deletedId': actor_id
-            })
-
-        except():
+        if delete_row(Actor, actor_id) is None:
             abort(404)
 
+        return jsonify({
+            'success': True,
+            'deletedId': actor_id
+        })
+
     @app.route('/actors/<int:actor_id>', methods=['PATCH'])
     @requires_auth('patch:actors')
     def update_actor(payload, actor_id):
         body = request.get_json()
 
-        if body is None:
+        if not isinstance(body, dict):
             abort(400)
 
-        try:
-            actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+        changes = actor_changes(body)
 
-            if actor is None:
-                abort(404)
+        if update_row(Actor, actor_id, changes) is None:
+            abort(404)
 
-            if 'name' in body:
-                actor.name = str(body.get('name'))
+        return jsonify({
+            'success': True,
+            'actorId': actor_id
+        })
 
-            if 'age' in body:
-                actor.age = int(body.get('age'))
+    @app.route('/actors', methods=['PATCH'])
+    @requires_auth('patch:actors')
+    def update_actors(payload):
+        body = parse_bulk_body(request)
+        condition = bulk_condition(body, Actor)
+        changes = actor_changes(body.get('set') or {})
 
-            if 'gender' in body:
-                actor.gender = str(body.get('gender'))
+        if not changes:
+            abort(400)
 
-            actor.update()
+        return jsonify({
+            'success': True,
+            'updatedIds': update_rows(Actor, condition, changes)
+        })
 
-            return jsonify({
-                'success': True,
-                'actorId': actor.id
-            })
+    @app.route('/actors', methods=['DELETE'])
+    @requires_auth('delete:actors')
+    def delete_actors(payload):
+        body = parse_bulk_body(request)
 
-        except():
-            abort(400)
+        return jsonify({
+            'success': True,
+            'deletedIds': delete_rows(Actor, bulk_condition(body, Actor))
+        })
 
     '''
     Movies endpoints
@@ -171,9 +1230,53 @@ def create_app():
     '''
     @app.route('/movies')
     @requires_auth('get:movies')
+    @conditional('movies', include=('casts', 'actors'))
+    @cached('movies', include=('casts', 'actors'))
     def list_movies(payload):
-        selection = Movie.query.order_by(Movie.id.desc()).all()
-        current_movies = paginate_movies(request, selection)
+        cast = include_cast(request)
+        names = field_names(request, Movie)
+
+        if 'since' in request.args:
+            selection = load_cast(Movie.query, Movie) if cast else Movie.query
+            page = sync_page(request, selection, Movie, synced(entity_format(cast, names)))
+
+            return jsonify({
+                'success': True,
+                'movies': page['changed'],
+                'deleted': page['deleted'],
+                'next_cursor': page['next_cursor'],
+                'has_more': page['has_more']
+            })
+
+        if 'ids' in request.args:
+            selection, format_row = read_selection(Movie, cast, names)
+            current_movies, missing = fetch_many(request, selection, Movie, format_row)
+
+            return jsonify({
+                'success': True,
+                'movies': current_movies,
+                'missing': missing
+            })
+
+        conditions = list_filters(request, Movie)
+        sort, order = list_order(request, Movie)
+        selection, format_row = read_selection(Movie, cast, names, [SORTS[Movie][sort]])
+        selection = order_list(selection.filter(*conditions), Movie, sort, order)
+
+        if 'after' in request.args:
+            current_movies, next_cursor = paginate_after(request, selection, Movie, format_row, sort, order)
+            result = {
+                'success': True,
+                'movies': current_movies,
+                'next_cursor': next_cursor
+            }
+
+            if wants_total(request):
+                result['total_movies'] = count(Movie, conditions)
+
+            return jsonify(result)
+
+        current_movies = paginate(request, selection, format_row)
 
         if len(current_movies) == 0:
             abort(404)
@@ -181,20 +1284,28 @@ def create_app():
         return jsonify({
             'success': True,
             'movies': current_movies,
-            'total_movies': len(Movie.query.all())
+            'total_movies': count(Movie, conditions)
         })
 
     @app.route('/movies/<int:movie_id>', methods=['GET'])
     @requires_auth('get:movies')
+    @conditional('movies', include=('casts', 'actors'))
+    @cached('movies:{movie_id}', 'movies:*', include=('casts', 'actors'))
     def get_movie(payload, movie_id):
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+        cast = include_cast(request)
+        selection = Movie.query.filter(Movie.id == movie_id)
+
+        if cast:
+            selection = load_cast(selection, Movie)
+
+        movie = selection.one_or_none()
 
         if movie is None:
             abort(404)
 
         return jsonify({
             'success': True,
-            'movie': movie.format()
+            'movie': movie.format(cast=cast)
         })
 
     @app.route('/movies', methods=['POST'])
@@ -217,55 +1328,296 @@ def create_app():
         except():
             abort(422)
 
+    @app.route('/movies/bulk', methods=['POST'])
+    @requires_auth('post:movies')
+    def new_movies(payload):
+        return bulk_create(request, Movie, validate_movie)
+
     @app.route('/movies/<int:movie_id>', methods=['DELETE'])
     @requires_auth('delete:movies')
     def delete_movie(payload, movie_id):
-        try:
-            movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+        if delete_row(Movie, movie_id) is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'deletedId': movie_id
+        })
 
-            if movie is None:
-                abort(404)
+    @app.route('/movies/<int:movie_id>', methods=['PATCH'])
+    @requires_auth('patch:movies')
+    def update_movie(payload, movie_id):
+        body = request.get_json()
 
-            movie.delete()
+        if not isinstance(body, dict):
+            abort(400)
 
-            return jsonify({
-                'success': True,
-                'deletedId': movie_id
-            })
+        changes = movie_changes(body)
 
-        except():
+        if update_row(Movie, movie_id, changes) is None:
             abort(404)
 
-    @app.route('/movies/<int:movie_id>', methods=['PATCH'])
+        return jsonify({
+            'success': True,
+            'movieId': movie_id
+        })
+
+    @app.route('/movies', methods=['PATCH'])
     @requires_auth('patch:movies')
-    def update_movie(payload, movie_id):
-        body = request.get_json()
+    def update_movies(payload):
+        body = parse_bulk_body(request)
+        condition = bulk_condition(body, Movie)
+        changes = movie_changes(body.get('set') or {})
 
-        if body is None:
+        if not changes:
             abort(400)
 
-        try:
-            movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+        return jsonify({
+            'success': True,
+            'updatedIds': update_rows(Movie, condition, changes)
+        })
 
-            if movie is None:
-                abort(404)
+    @app.route('/movies', methods=['DELETE'])
+    @requires_auth('delete:movies')
+    def delete_movies(payload):
+        body = parse_bulk_body(request)
 
-            if 'name' in body:
-                movie.name = str(body.get('name'))
+        return jsonify({
+            'success': True,
+            'deletedIds': delete_rows(Movie, bulk_condition(body, Movie))
+        })
 
-            if 'release' in body:
-                movie.year = int(body.get('release'))
+    '''
+    Search endpoint
 
-            movie.update()
+    '''
+    @app.route('/search')
+    @requires_auth()
+    def search(payload):
+        name = request.args.get('type')
+        model = SEARCHES.get(name)
 
-            return jsonify({
-                'success': True,
-                'movieId': movie.id
-            })
+        if model is None:
+            abort(400)
 
-        except():
+        check_permissions('get:' + name, payload)
+
+        query = request.args.get('q', '').strip()
+        prefix = request.args.get('prefix', '').lower() in ('1', 'true', 'yes')
+        limit = page_size(request)
+
+        if not query or len(query) > SEARCH_MAX_LENGTH:
             abort(400)
 
+        if trigram_available():
+            engine = 'trigram'
+            selection = trigram_search(model, query, prefix, limit)
+
+        else:
+            engine = 'fallback'
+            selection = fallback_search(name, model, query, prefix, limit)
+
+        return jsonify({
+            'success': True,
+            'type': name,
+            'engine': engine,
+            'results': [item.format() for item in selection]
+        })
+
+    '''
+    Statistics endpoint
+
+    '''
+    @app.route('/stats')
+    @requires_auth('get:movies')
+    def get_stats(payload):
+        check_permissions('get:actors', payload)
+
+        stats = catalog_stats()
+        stale = stats_changed(stats)
+
+        if stale and stats_age(stats) >= app.config['STATS_MAX_AGE'] and refresh_catalog_stats():
+            stats = catalog_stats()
+            stale = stats_changed(stats)
+
+        return jsonify({
+            'success': True,
+            'stats': {
+                'movies': stats['movies'],
+                'actors': stats['actors'],
+                'casts': stats['casts'],
+                'movies_per_year': stats['movies_per_year'],
+                'actors_per_age_group': stats['actors_per_age_group'],
+                'actors_per_gender': stats['actors_per_gender'],
+                'average_cast_size': stats['average_cast_size']
+            },
+            'refreshed_at': stats['refreshed_at'].isoformat(),
+            'stale': stale
+        })
+
+    '''
+    Cast endpoints
+
+    '''
+    @app.route('/casts')
+    @requires_auth('get:movies')
+    @conditional('casts')
+    @cached('casts')
+    def list_casts(payload):
+        page = sync_page(request, Cast.query, Cast, synced(lambda casting: dict(casting.format(), id=casting.id)))
+
+        return jsonify({
+            'success': True,
+            'casts': page['changed'],
+            'deleted': page['deleted'],
+            'next_cursor': page['next_cursor'],
+            'has_more': page['has_more']
+        })
+
+    @app.route('/movies/<int:movie_id>/cast', methods=['GET'])
+    @requires_auth('get:movies')
+    @conditional('movies', 'casts', 'actors')
+    @cached('movies:{movie_id}', 'movies:*', 'casts', 'actors')
+    def get_cast(payload, movie_id):
+        if not movie_exists(movie_id):
+            abort(404)
+
+        selection = Actor.query.join(Cast, Cast.actor_id == Actor.id) \
+            .filter(Cast.movie_id == movie_id) \
+            .order_by(Actor.id)
+
+        return jsonify({
+            'success': True,
+            'movieId': movie_id,
+            'actors': [actor.format() for actor in selection]
+        })
+
+    @app.route('/movies/<int:movie_id>/cast', methods=['POST'])
+    @requires_auth('patch:movies')
+    def new_cast(payload, movie_id):
+        actor_ids = parse_actor_ids(request)
+
+        if not movie_exists(movie_id):
+            abort(404)
+
+        casts = Cast.__table__
+        selection = select(literal(movie_id), Actor.id).where(Actor.id.in_(actor_ids))
+        statement = insert(casts) \
+            .from_select(['movie_id', 'actor_id'], selection) \
+            .on_conflict_do_nothing(index_elements=['movie_id', 'actor_id']) \
+            .returning(casts.c.actor_id)
+
+        try:
+            added = set(db.session.execute(statement).scalars())
+            record_change(casts.name, 'insert')
+            save()
+
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'movieId': movie_id,
+            'added': [actor_id for actor_id in actor_ids if actor_id in added],
+            'skipped': [actor_id for actor_id in actor_ids if actor_id not in added]
+        })
+
+    @app.route('/movies/<int:movie_id>/cast', methods=['DELETE'])
+    @requires_auth('patch:movies')
+    def delete_cast(payload, movie_id):
+        actor_ids = parse_actor_ids(request)
+
+        if not movie_exists(movie_id):
+            abort(404)
+
+        casts = Cast.__table__
+        statement = casts.delete() \
+            .where(casts.c.movie_id == movie_id, casts.c.actor_id.in_(actor_ids)) \
+            .returning(casts.c.actor_id)
+
+        try:
+            removed = set(db.session.execute(statement).scalars())
+            record_change(casts.name, 'delete')
+            save()
+
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'movieId': movie_id,
+            'removed': [actor_id for actor_id in actor_ids if actor_id in removed]
+        })
+
+    '''
+    Change stream
+    Server-Sent Events for every committed insert, update and
+    delete. The stream holds no database connection, only a
+    thread and a bounded buffer, and resumes from Last-Event-ID
+
+    '''
+    @app.route('/changes/stream')
+    @requires_auth('get:movies')
+    def stream_changes(payload):
+        permissions = payload.get('permissions', [])
+        tables = {'movies', 'casts'}
+
+        if 'get:actors' in permissions:
+            tables.add('actors')
+
+        subscriber = change_feed.subscribe(request.headers.get('Last-Event-ID'))
+
+        if subscriber is None:
+            abort(503)
+
+        def generate():
+            try:
+                yield 'retry: 3000\n\n'
+
+                while not subscriber.closed:
+                    event = subscriber.get(FEED_HEARTBEAT)
+
+                    if event is None:
+                        yield ': keep-alive\n\n'
+
+                    elif event['type'] == 'reset':
+                        yield 'event: reset\ndata: {}\n\n'
+
+                    elif event['data']['table'] in tables:
+                        yield 'id: %s\nevent: %s\ndata: %s\n\n' % (
+                            event['id'], event['type'], json.dumps(event['data'])
+                        )
+
+            finally:
+                change_feed.unsubscribe(subscriber)
+
+        response = Response(generate(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+
+        return response
+
+    '''
+    Export endpoints
+
+    '''
+    @app.route('/export/actors')
+    @requires_auth('get:actors')
+    def export_actors(payload):
+        return export(request, Actor)
+
+    @app.route('/export/movies')
+    @requires_auth('get:movies')
+    def export_movies(payload):
+        return export(request, Movie)
+
+    @app.route('/export/casts')
+    @requires_auth('get:movies')
+    def export_casts(payload):
+        return export(request, Cast)
+
     '''
     Error handlers
 
@@ -286,6 +1638,14 @@ def create_app():
             "message": "unprocessable"
         }), 422
 
+    @app.errorhandler(413)
+    def too_large(error):
+        return jsonify({
+            "success": False,
+            "error": 413,
+            "message": "payload too large"
+        }), 413
+
     @app.errorhandler(400)
     def bad_request(error):
         return jsonify({
@@ -310,6 +1670,14 @@ def create_app():
             "message": "method not allowed"
         }), 405
 
+    @app.errorhandler(503)
+    def unavailable(error):
+        return jsonify({
+            "success": False,
+            "error": 503,
+            "message": "service unavailable"
+        }), 503
+
     @app.errorhandler(AuthError)
     def handle_auth_error(ex):
         response = jsonify(ex.error)
@@ -2,8 +2,13 @@ import os
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
-from app import create_app
-from .database.models import setup_db, db_drop_and_create_all, Actor, Movie
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
+from app import create_app, BULK_CHUNK_SIZE
+from .database.models import setup_db, db_drop_and_create_all, db, unit_of_work, commit_count, on_change, change_listeners, has_extension, table_versions, STATS_LOCK, Actor, Movie, Cast
+from .cache.response_cache import response_cache
+from .feed.change_feed import change_feed
+from .serialization.json_provider import StdlibProvider, make_provider
 
 
 class AgencyTestCase(unittest.TestCase):
@@ -30,9 +35,90 @@ class AgencyTestCase(unittest.TestCase):
             self.db.init_app(self.app)
             db_drop_and_create_all()
 
+        response_cache.clear()
+
     def tearDown(self):
         pass
 
+    def count_queries(self, method, *args, **kwargs):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            # The ETag version lookup reads no rows of the entities
+            if 'table_versions' not in statement:
+                statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+
+        try:
+            res = method(*args, **kwargs)
+
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+        return res, len(statements)
+
+    def seed_casts(self, movies, actors):
+        with self.app.app_context():
+            for year in range(2000, 2000 + movies):
+                movie = Movie(name='Movie %d' % year, year=year)
+                movie.insert()
+
+                for age in range(20, 20 + actors):
+                    actor = Actor(name='Actor %d' % age, age=age, gender='f')
+                    actor.insert()
+                    Cast(movie_id=movie.id, actor_id=actor.id).insert()
+
+    def seed_catalog(self, rows):
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(text(
+                    "INSERT INTO movies (name, year) "
+                    "SELECT 'Movie ' || n, 1900 + mod(n, 120) FROM generate_series(1, :rows) n"
+                ), {'rows': rows})
+                connection.execute(text(
+                    "INSERT INTO actors (name, age, gender) "
+                    "SELECT 'Actor ' || n, mod(n, 90), CASE WHEN mod(n, 2) = 0 THEN 'f' ELSE 'm' END "
+                    "FROM generate_series(1, :rows) n"
+                ), {'rows': rows})
+                connection.execute(text('ANALYZE movies'))
+                connection.execute(text('ANALYZE actors'))
+
+    def explain(self, path, table):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, *args):
+            if 'FROM %s' % table in statement and 'ORDER BY' in statement:
+                statements.append(cursor.mogrify(statement, parameters).decode())
+
+        with self.app.app_context():
+            engine = db.engine
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+
+        try:
+            res = self.client().get(path, headers=self.headers)
+
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+        self.assertEqual(res.status_code, 200)
+
+        connection = engine.raw_connection()
+
+        try:
+            cursor = connection.cursor()
+            cursor.execute('EXPLAIN ' + statements[0])
+            plan = [row[0] for row in cursor.fetchall()]
+
+        finally:
+            connection.close()
+
+        return '\n'.join(plan)
+
     def testNewActor(self):
         res = self.client().post('/actors', headers=self.headers, json=self.new_actor)
         data = json.loads(res.data)
@@ -41,6 +127,44 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['actor'])
 
+    def testBulkNewActors(self):
+        actors = [dict(self.new_actor, age=age) for age in range(30, 35)]
+        res = self.client().post('/actors/bulk', headers=self.headers, json=actors)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['created'], 5)
+        self.assertEqual(len(set(data['ids'])), 5)
+
+        with self.app.app_context():
+            ages = [Actor.query.get(actor_id).age for actor_id in data['ids']]
+
+        self.assertEqual(ages, list(range(30, 35)))
+
+    def testBulkNewActorsAtomic(self):
+        actors = [self.new_actor, dict(self.new_actor, age='old')]
+        res = self.client().post('/actors/bulk', headers=self.headers, json=actors)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['errors'][0]['index'], 1)
+
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 1)
+
+    def testBulkNewActorsPartial(self):
+        actors = [{'name': 'Nobody'}, self.new_actor]
+        res = self.client().post('/actors/bulk?mode=partial', headers=self.headers, json=actors)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['created'], 1)
+        self.assertIsNone(data['ids'][0])
+        self.assertTrue(data['ids'][1])
+        self.assertEqual(data['errors'][0]['index'], 0)
+
     def testNotAllowedNewActor(self):
         res = self.client().post('/actors/100', headers=self.headers)
         data = json.loads(res.data)
@@ -66,6 +190,91 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    def testPaginateActors(self):
+        with self.app.app_context():
+            for age in range(20, 25):
+                Actor(name='Actor %d' % age, age=age, gender='f').insert()
+
+        res = self.client().get('/actors?page=2&limit=2', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['age'] for actor in data['actors']], [22, 21])
+        self.assertEqual(data['total_actors'], 6)
+
+    def testCursorActors(self):
+        with self.app.app_context():
+            for age in range(20, 25):
+                Actor(name='Actor %d' % age, age=age, gender='f').insert()
+
+        ages = []
+        cursor = ''
+
+        while cursor is not None:
+            res = self.client().get('/actors?limit=2&after=' + cursor, headers=self.headers)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertNotIn('total_actors', data)
+            ages += [actor['age'] for actor in data['actors']]
+            cursor = data['next_cursor']
+
+        self.assertEqual(ages, [24, 23, 22, 21, 20, 65])
+
+    def testCursorTotal(self):
+        res = self.client().get('/movies?after=&total=true', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_movies'], 1)
+        self.assertIsNone(data['next_cursor'])
+
+    def testBadRequestCursor(self):
+        res = self.client().get('/actors?after=not-a-cursor', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def testMultiGetActors(self):
+        with self.app.app_context():
+            for age in range(20, 23):
+                Actor(name='Actor %d' % age, age=age, gender='f').insert()
+
+        res, queries = self.count_queries(self.client().get, '/actors?ids=3,100,1,3', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['id'] for actor in data['actors']], [3, 1])
+        self.assertEqual(data['missing'], [100])
+        self.assertEqual(queries, 1)
+
+    def testMultiGetMoviesWithCast(self):
+        self.seed_casts(movies=2, actors=1)
+
+        res = self.client().get('/movies?ids=3,2&include=cast', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([movie['id'] for movie in data['movies']], [3, 2])
+        self.assertEqual(data['movies'][0]['cast'][0]['id'], 3)
+        self.assertEqual(data['missing'], [])
+
+    def testBadRequestMultiGet(self):
+        res = self.client().get('/movies?ids=1,two', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def testBadRequestPageSize(self):
+        res = self.client().get('/actors?limit=0', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'bad request')
+
     def testActor(self):
         res = self.client().get('/actors/1', headers=self.headers)
         data = json.loads(res.data)
@@ -92,6 +301,32 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['actorId'], 1)
         self.assertEqual(actor.format()['gender'], 'm')
 
+    def testPatchActorSingleStatement(self):
+        res, queries = self.count_queries(
+            self.client().patch, '/actors/1', headers=self.headers, json={'age': 66})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actorId'], 1)
+        self.assertEqual(queries, 1)
+
+        with self.app.app_context():
+            self.assertEqual(Actor.query.get(1).age, 66)
+
+    def testNotFoundPatchActor(self):
+        res = self.client().patch('/actors/100', headers=self.headers, json={'age': 66})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def testBadRequestPatchActorAge(self):
+        res = self.client().patch('/actors/1', headers=self.headers, json={'age': 'old'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def testBadRequestPatchActor(self):
         res = self.client().patch('/actors/1?gender=m', headers=self.headers)
         data = json.loads(res.data)
@@ -108,6 +343,66 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['deletedId'])
 
+    def testDeleteCastActor(self):
+        self.seed_casts(movies=3, actors=1)
+
+        res, queries = self.count_queries(self.client().delete, '/actors/2', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deletedId'], 2)
+        self.assertEqual(queries, 1)
+
+        with self.app.app_context():
+            self.assertEqual(Cast.query.filter(Cast.actor_id == 2).count(), 0)
+            self.assertEqual(Cast.query.count(), 2)
+
+    def testBulkDeleteActors(self):
+        with self.app.app_context():
+            for age in range(20, 25):
+                Actor(name='Actor %d' % age, age=age, gender='f').insert()
+
+        res = self.client().delete('/actors', headers=self.headers, json={'ids': [2, 3, 100]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deletedIds'], [2, 3])
+
+        res = self.client().delete('/actors', headers=self.headers, json={'filter': {'age': {'gte': 23}}})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['deletedIds'], [1, 5, 6])
+
+        with self.app.app_context():
+            self.assertEqual([actor.age for actor in Actor.query.all()], [22])
+
+    def testBadRequestBulkDeleteActors(self):
+        for body in ({}, {'filter': {}}, {'filter': {'salary': 1}}, {'ids': [1], 'filter': {'age': 1}}):
+            res = self.client().delete('/actors', headers=self.headers, json=body)
+
+            self.assertEqual(res.status_code, 400)
+
+        with self.app.app_context():
+            self.assertEqual(Actor.query.count(), 1)
+
+    def testBadRequestFilterOperands(self):
+        filters = (
+            {'age': {'gt': 'abc'}},
+            {'age': {'in': [20, 'abc']}},
+            {'age': True},
+            {'name': 5},
+            {'gender': {'eq': None}}
+        )
+
+        for expression in filters:
+            res = self.client().delete('/actors', headers=self.headers, json={'filter': expression})
+
+            self.assertEqual(res.status_code, 400, expression)
+
+        res = self.client().patch('/movies', headers=self.headers, json={'filter': {'release': '1990'}, 'set': {'name': 'X'}})
+
+        self.assertEqual(res.status_code, 400)
+
     def testNotFoundDeleteActor(self):
         res = self.client().delete('/actors/100', headers=self.headers)
         data = json.loads(res.data)
@@ -124,6 +419,23 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['movie'])
 
+    def testBulkNewMoviesNDJSON(self):
+        lines = '\n'.join(json.dumps(dict(self.new_movie, year=year)) for year in range(1990, 1993))
+        headers = dict(self.headers, **{'Content-Type': 'application/x-ndjson'})
+        res = self.client().post('/movies/bulk', headers=headers, data=lines)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['created'], 3)
+
+    def testBadRequestBulkMovies(self):
+        res = self.client().post('/movies/bulk', headers=self.headers, json=self.new_movie)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def testNotAllowedNewMovie(self):
         res = self.client().post('/movies/100', headers=self.headers)
         data = json.loads(res.data)
@@ -149,6 +461,18 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    def testPaginateMovies(self):
+        with self.app.app_context():
+            for year in range(2000, 2005):
+                Movie(name='Movie %d' % year, year=year).insert()
+
+        res = self.client().get('/movies?page=3&limit=2', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([movie['release'] for movie in data['movies']], [2000, 2021])
+        self.assertEqual(data['total_movies'], 6)
+
     def testMovie(self):
         res = self.client().get('/movies/1', headers=self.headers)
         data = json.loads(res.data)
@@ -175,6 +499,35 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['movieId'], 1)
         self.assertEqual(movie.format()['name'], 'Finch')
 
+    def testBulkPatchMovies(self):
+        with self.app.app_context():
+            for year in range(1995, 2000):
+                Movie(name='Movie %d' % year, year=year).insert()
+
+        body = {'filter': {'release': {'gte': 1997, 'lt': 2000}}, 'set': {'release': 2001}}
+        res, queries = self.count_queries(self.client().patch, '/movies', headers=self.headers, json=body)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updatedIds'], [4, 5, 6])
+        self.assertEqual(queries, 1)
+
+        res = self.client().patch('/movies', headers=self.headers, json={'ids': [2, 3], 'set': {'name': 'Sequel'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['updatedIds'], [2, 3])
+
+        with self.app.app_context():
+            self.assertEqual(Movie.query.filter(Movie.year == 2001).count(), 3)
+            self.assertEqual(Movie.query.filter(Movie.name == 'Sequel').count(), 2)
+
+    def testBadRequestBulkPatchMovies(self):
+        res = self.client().patch('/movies', headers=self.headers, json={'ids': [1], 'set': {}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def testBadRequestPatchMovie(self):
         res = self.client().patch('/movies/1?year=2021', headers=self.headers)
         data = json.loads(res.data)
@@ -191,6 +544,20 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['deletedId'])
 
+    def testDeleteCastMovie(self):
+        self.seed_casts(movies=1, actors=3)
+
+        res = self.client().delete('/movies/2', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deletedId'], 2)
+
+        with self.app.app_context():
+            self.assertIsNone(Movie.query.get(2))
+            self.assertEqual(Cast.query.count(), 0)
+            self.assertEqual(Actor.query.count(), 4)
+
     def testNotFoundDeleteMovie(self):
         res = self.client().delete('/movies/100', headers=self.headers)
         data = json.loads(res.data)
@@ -199,6 +566,855 @@ class AgencyTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'resource not found')
 
+    def testNewCast(self):
+        with self.app.app_context():
+            Actor(name='Meg Ryan', age=60, gender='f').insert()
+
+        res = self.client().post('/movies/1/cast', headers=self.headers, json={'actors': [1, 2, 2, 100]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['added'], [1, 2])
+        self.assertEqual(data['skipped'], [100])
+
+        res = self.client().post('/movies/1/cast', headers=self.headers, json={'actors': [1]})
+        data = json.loads(res.data)
+
+        self.assertEqual(data['added'], [])
+        self.assertEqual(data['skipped'], [1])
+
+        res = self.client().get('/movies/1/cast', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual([actor['id'] for actor in data['actors']], [1, 2])
+
+    def testDeleteCast(self):
+        with self.app.app_context():
+            Cast(movie_id=1, actor_id=1).insert()
+
+        res = self.client().delete('/movies/1/cast', headers=self.headers, json={'actors': [1]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['removed'], [1])
+
+        with self.app.app_context():
+            self.assertEqual(Cast.query.count(), 0)
+
+    def testDeleteCastNotFound(self):
+        with self.app.app_context():
+            before = table_versions(['casts'])
+
+        res = self.client().delete('/movies/100/cast', headers=self.headers, json={'actors': [1]})
+
+        self.assertEqual(res.status_code, 404)
+
+        with self.app.app_context():
+            self.assertEqual(table_versions(['casts']), before)
+
+    def testNotFoundCast(self):
+        res = self.client().post('/movies/100/cast', headers=self.headers, json={'actors': [1]})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    def testBadRequestCast(self):
+        res = self.client().post('/movies/1/cast', headers=self.headers, json={'actors': 'Tom Hanks'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def testIncludeCast(self):
+        self.seed_casts(movies=1, actors=2)
+
+        res = self.client().get('/movies/2?include=cast', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['name'] for actor in data['movie']['cast']], ['Actor 20', 'Actor 21'])
+
+        res = self.client().get('/actors/2?include=cast', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([movie['release'] for movie in data['actor']['movies']], [2000])
+
+    def testIncludeCastQueryCount(self):
+        self.seed_casts(movies=5, actors=3)
+
+        res, small_page = self.count_queries(
+            self.client().get, '/movies?include=cast&limit=1', headers=self.headers)
+        self.assertEqual(len(json.loads(res.data)['movies'][0]['cast']), 3)
+
+        res, large_page = self.count_queries(
+            self.client().get, '/movies?include=cast&limit=6', headers=self.headers)
+        self.assertEqual(len(json.loads(res.data)['movies']), 6)
+
+        self.assertEqual(small_page, large_page)
+        self.assertLessEqual(large_page, 3)
+
+        res, actors_page = self.count_queries(
+            self.client().get, '/actors?include=cast&limit=16', headers=self.headers)
+        self.assertEqual(len(json.loads(res.data)['actors']), 16)
+        self.assertLessEqual(actors_page, 3)
+
+    def testBadRequestInclude(self):
+        res = self.client().get('/movies?include=crew', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def testHealth(self):
+        self.client().get('/actors', headers=self.headers)
+        res = self.client().get('/health')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['database']['pool'], 'TimedQueuePool')
+        self.assertEqual(data['database']['checked_out'], 0)
+        self.assertGreaterEqual(data['database']['waits'], 1)
+        self.assertIn('hits', data['tokens'])
+        self.assertIn('hit_ratio', data['cache'])
+
+    def use_replica(self):
+        replica_path = os.environ.get('DATABASE_REPLICA_URL', self.database_path)
+        setup_db(self.app, self.database_path, [replica_path])
+        router = self.app.extensions['replicas']
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = router.engines[0]
+        self.addCleanup(engine.dispose)
+
+        if replica_path != self.database_path:
+            db.metadata.drop_all(bind=engine)
+            db.metadata.create_all(bind=engine)
+
+            with engine.begin() as connection:
+                connection.execute(Actor.__table__.insert(), self.new_actor)
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        self.addCleanup(event.remove, engine, 'before_cursor_execute', before_cursor_execute)
+
+        return router, statements
+
+    def testReadsUseReplica(self):
+        router, statements = self.use_replica()
+        res = self.client().get('/actors', headers=self.headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(statements)
+        self.assertEqual(router.stats()[0]['reads'], 1)
+
+    def testWritesUsePrimary(self):
+        router, statements = self.use_replica()
+        res = self.client().post('/actors', headers=self.headers, json=self.new_actor)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(statements, [])
+        self.assertIn('db_primary_until', res.headers['Set-Cookie'])
+
+    def testReadYourWrites(self):
+        router, statements = self.use_replica()
+        client = self.client()
+        client.post('/actors', headers=self.headers, json=self.new_actor)
+        res = client.get('/actors', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(statements, [])
+        self.assertEqual(data['total_actors'], 2)
+
+    def testReadYourWritesWithoutCookie(self):
+        router, statements = self.use_replica()
+        self.client().post('/actors', headers=self.headers, json=self.new_actor)
+        res = self.client().get('/actors', headers=self.headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(statements, [])
+        self.assertEqual(json.loads(res.data)['total_actors'], 2)
+
+    def testReplicaDown(self):
+        router, statements = self.use_replica()
+        router.mark_down(router.engines[0])
+        res = self.client().get('/actors', headers=self.headers)
+        health = json.loads(self.client().get('/health').data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(statements, [])
+        self.assertFalse(health['replicas'][0]['healthy'])
+
+    def testCachedRead(self):
+        first = self.client().get('/actors/1', headers=self.headers)
+        second, queries = self.count_queries(self.client().get, '/actors/1', headers=self.headers)
+
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(queries, 0)
+
+    def testCacheKeyedByQuery(self):
+        self.client().get('/actors', headers=self.headers)
+        res = self.client().get('/actors?include=cast', headers=self.headers)
+
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+
+    def testCacheNotStoredForErrors(self):
+        self.client().get('/actors/1000', headers=self.headers)
+        res = self.client().get('/actors/1000', headers=self.headers)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertNotIn('X-Cache', res.headers)
+
+    def testCacheInvalidatedByUpdate(self):
+        self.client().get('/actors/1', headers=self.headers)
+        self.client().get('/movies/1', headers=self.headers)
+        self.client().patch('/actors/1', headers=self.headers, json={'name': 'Tom Cruise'})
+        actor = self.client().get('/actors/1', headers=self.headers)
+        movie = self.client().get('/movies/1', headers=self.headers)
+
+        self.assertEqual(actor.headers['X-Cache'], 'MISS')
+        self.assertEqual(json.loads(actor.data)['actor']['name'], 'Tom Cruise')
+        self.assertEqual(movie.headers['X-Cache'], 'HIT')
+
+    def testCacheInvalidatedByInsert(self):
+        self.client().get('/actors', headers=self.headers)
+        self.client().post('/actors', headers=self.headers, json=self.new_actor)
+        res = self.client().get('/actors', headers=self.headers)
+
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+        self.assertEqual(json.loads(res.data)['total_actors'], 2)
+
+    def testCacheInvalidatedByCast(self):
+        self.client().get('/movies/1?include=cast', headers=self.headers)
+        self.client().get('/movies/1', headers=self.headers)
+        self.client().post('/movies/1/cast', headers=self.headers, json={'actors': [1]})
+        included = self.client().get('/movies/1?include=cast', headers=self.headers)
+        plain = self.client().get('/movies/1', headers=self.headers)
+
+        self.assertEqual(included.headers['X-Cache'], 'MISS')
+        self.assertEqual(len(json.loads(included.data)['movie']['cast']), 1)
+        self.assertEqual(plain.headers['X-Cache'], 'HIT')
+
+    def testCacheKeptOnRollback(self):
+        self.client().get('/actors', headers=self.headers)
+
+        # The first chunk is inserted and recorded before the second fails in Postgres
+        batch = [self.new_actor] * BULK_CHUNK_SIZE + [dict(self.new_actor, age=2 ** 40)]
+        failed = self.client().post('/actors/bulk', headers=self.headers, json=batch)
+        res = self.client().get('/actors', headers=self.headers)
+
+        self.assertEqual(failed.status_code, 422)
+        self.assertEqual(res.headers['X-Cache'], 'HIT')
+        self.assertEqual(json.loads(res.data)['total_actors'], 1)
+
+    def testCacheKeyedByReplicaVersions(self):
+        router, statements = self.use_replica()
+        self.client().get('/actors/1', headers=self.headers)
+
+        # The primary committed a new name, the replica has not replayed it yet
+        response_cache.invalidate([('actors', 'update', [1])])
+        stale = self.client().get('/actors/1', headers=self.headers)
+
+        with router.engines[0].begin() as connection:
+            connection.execute(text("UPDATE actors SET name = 'Caught Up' WHERE id = 1"))
+
+        res = self.client().get('/actors/1', headers=self.headers)
+
+        self.assertEqual(stale.headers['X-Cache'], 'MISS')
+        self.assertEqual(res.headers['X-Cache'], 'MISS')
+        self.assertEqual(json.loads(res.data)['actor']['name'], 'Caught Up')
+
+    def testETag(self):
+        first = self.client().get('/actors', headers=self.headers)
+        headers = dict(self.headers, **{'If-None-Match': first.headers['ETag']})
+        second, queries = self.count_queries(self.client().get, '/actors', headers=headers)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b'')
+        self.assertEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(queries, 0)
+
+    def testETagKeyedByQuery(self):
+        first = self.client().get('/actors', headers=self.headers)
+        second = self.client().get('/actors?include=cast', headers=self.headers)
+
+        self.assertNotEqual(first.headers['ETag'], second.headers['ETag'])
+
+    def testETagChangedByWrite(self):
+        first = self.client().get('/movies', headers=self.headers)
+        self.client().post('/movies', headers=self.headers, json=self.new_movie)
+        headers = dict(self.headers, **{'If-None-Match': first.headers['ETag']})
+        second = self.client().get('/movies', headers=headers)
+
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second.headers['ETag'], first.headers['ETag'])
+        self.assertEqual(json.loads(second.data)['total_movies'], 2)
+
+    def testETagKeptByOtherTable(self):
+        first = self.client().get('/movies/1', headers=self.headers)
+        self.client().patch('/actors/1', headers=self.headers, json={'name': 'Tom Cruise'})
+        headers = dict(self.headers, **{'If-None-Match': first.headers['ETag']})
+        second = self.client().get('/movies/1', headers=headers)
+
+        self.assertEqual(second.status_code, 304)
+
+    def testETagChangedByCast(self):
+        first = self.client().get('/movies/1/cast', headers=self.headers)
+        self.client().post('/movies/1/cast', headers=self.headers, json={'actors': [1]})
+        headers = dict(self.headers, **{'If-None-Match': first.headers['ETag']})
+        second = self.client().get('/movies/1/cast', headers=headers)
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(len(json.loads(second.data)['actors']), 1)
+
+    def testSyncSince(self):
+        res = self.client().get('/actors?since=2000-01-01T00:00:00Z', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['id'] for actor in data['actors']], [1])
+        self.assertIn('updated_at', data['actors'][0])
+        self.assertEqual(data['deleted'], [])
+        self.assertFalse(data['has_more'])
+
+        created = json.loads(self.client().post('/actors', headers=self.headers, json=self.new_actor).data)
+        self.client().patch('/actors/1', headers=self.headers, json={'name': 'Tom Cruise'})
+        self.client().delete('/actors/%d' % created['actor']['id'], headers=self.headers)
+
+        res = self.client().get(
+            '/actors?since=2000-01-01T00:00:00Z&after=%s' % data['next_cursor'], headers=self.headers
+        )
+        changes = json.loads(res.data)
+
+        self.assertEqual([actor['name'] for actor in changes['actors']], ['Tom Cruise'])
+        self.assertEqual(changes['deleted'], [created['actor']['id']])
+
+    def testSyncUnchanged(self):
+        first = json.loads(self.client().get('/movies?since=2000-01-01', headers=self.headers).data)
+        res = self.client().get(
+            '/movies?since=2000-01-01&after=%s' % first['next_cursor'], headers=self.headers
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(data['movies'], [])
+        self.assertEqual(data['deleted'], [])
+        self.assertEqual(data['next_cursor'], first['next_cursor'])
+
+    def testSyncPaging(self):
+        actors = [dict(self.new_actor, age=age) for age in range(30, 35)]
+        self.client().post('/actors/bulk', headers=self.headers, json=actors)
+        seen = []
+        cursor = None
+
+        while True:
+            path = '/actors?since=2000-01-01&limit=2' + ('&after=%s' % cursor if cursor else '')
+            data = json.loads(self.client().get(path, headers=self.headers).data)
+            seen.extend(actor['id'] for actor in data['actors'])
+            cursor = data['next_cursor']
+
+            if not data['has_more']:
+                break
+
+        self.assertEqual(sorted(seen), list(range(1, 7)))
+
+    def testSyncCastTombstones(self):
+        self.client().post('/movies/1/cast', headers=self.headers, json={'actors': [1]})
+        first = json.loads(self.client().get('/casts', headers=self.headers).data)
+        self.client().delete('/movies/1', headers=self.headers)
+        res = self.client().get('/casts?after=%s' % first['next_cursor'], headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual([(cast['movie_id'], cast['actor_id']) for cast in first['casts']], [(1, 1)])
+        self.assertEqual(data['casts'], [])
+        self.assertEqual(data['deleted'], [first['casts'][0]['id']])
+
+    def testSyncLateCommit(self):
+        with self.app.app_context():
+            connection = db.engine.connect()
+            transaction = connection.begin()
+            connection.execute(Actor.__table__.insert().values(name='Late Actor', age=40, gender='f'))
+
+        try:
+            self.client().post('/actors', headers=self.headers, json=self.new_actor)
+            res = self.client().get('/actors?since=2000-01-01T00:00:00Z', headers=self.headers)
+            data = json.loads(res.data)
+
+            self.assertEqual([actor['id'] for actor in data['actors']], [1])
+            self.assertIsNone(res.headers.get('ETag'))
+            self.assertNotEqual(res.headers.get('X-Cache'), 'HIT')
+
+            transaction.commit()
+
+        finally:
+            connection.close()
+
+        res = self.client().get(
+            '/actors?since=2000-01-01T00:00:00Z&after=%s' % data['next_cursor'], headers=self.headers
+        )
+        changes = json.loads(res.data)
+
+        self.assertEqual([actor['name'] for actor in changes['actors']], ['Late Actor', self.new_actor['name']])
+        self.assertIsNotNone(res.headers.get('ETag'))
+
+    def testSyncBadTimestamp(self):
+        for since in ('yesterday', '2000-13-01', '2000-01-01T25:00:00Z'):
+            res = self.client().get('/actors?since=' + since, headers=self.headers)
+
+            self.assertEqual(res.status_code, 400, since)
+
+    def testSyncTimestampFormats(self):
+        for since in ('2000-01-01', '2000-01-01T00:00:00Z', '2000-01-01T00:00:00.5+02:00', '20000101T000000Z'):
+            res = self.client().get('/actors?since=' + since.replace('+', '%2B'), headers=self.headers)
+
+            self.assertEqual(res.status_code, 200, since)
+            self.assertEqual([actor['id'] for actor in json.loads(res.data)['actors']], [1])
+
+    def read_events(self, res, count):
+        chunks = iter(res.response)
+        events = [next(chunks).decode() for _ in range(count)]
+        res.close()
+
+        return events
+
+    def testChangeStream(self):
+        res = self.client().get('/changes/stream', headers=self.headers, buffered=False)
+        created = json.loads(self.client().post('/actors', headers=self.headers, json=self.new_actor).data)
+        events = self.read_events(res, 2)
+        data = json.loads(events[1].split('data: ')[1])
+
+        self.assertEqual(res.mimetype, 'text/event-stream')
+        self.assertTrue(events[0].startswith('retry:'))
+        self.assertIn('event: change', events[1])
+        self.assertEqual(data, {'table': 'actors', 'op': 'insert', 'ids': [created['actor']['id']]})
+        self.assertEqual(change_feed.stats()['subscribers'], 0)
+
+    def testChangeStreamResume(self):
+        self.client().patch('/movies/1', headers=self.headers, json={'release': 1999})
+        last_event_id = change_feed.history[-1]['id']
+        self.client().delete('/movies/1', headers=self.headers)
+        headers = dict(self.headers, **{'Last-Event-ID': last_event_id})
+        res = self.client().get('/changes/stream', headers=headers, buffered=False)
+        events = self.read_events(res, 2)
+
+        self.assertIn('"op": "delete"', events[1])
+        self.assertNotIn(last_event_id, events[1])
+
+    def testChangeStreamReset(self):
+        headers = dict(self.headers, **{'Last-Event-ID': 'unknown'})
+        res = self.client().get('/changes/stream', headers=headers, buffered=False)
+        events = self.read_events(res, 2)
+
+        self.assertTrue(events[1].startswith('event: reset'))
+
+    def testFilterMovies(self):
+        movies = [dict(self.new_movie, year=year) for year in (1990, 1995, 2000, 2005)]
+        self.client().post('/movies/bulk', headers=self.headers, json=movies)
+        res = self.client().get('/movies?year_min=1995&year_max=2005&sort=year&order=desc&limit=10', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([movie['release'] for movie in data['movies']], [2005, 2000, 1995])
+        self.assertEqual(data['total_movies'], 3)
+
+    def testFilterActors(self):
+        actors = [{'name': name, 'age': age, 'gender': gender} for name, age, gender in (
+            ('Cate', 50, 'f'), ('Ana', 30, 'f'), ('Bob', 40, 'm'), ('Dora', 20, 'f')
+        )]
+        self.client().post('/actors/bulk', headers=self.headers, json=actors)
+        res = self.client().get('/actors?gender=f&age_min=25&sort=name&limit=10', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual([actor['name'] for actor in data['actors']], ['Ana', 'Cate', 'Tom Hanks'])
+
+    def testSortedKeyset(self):
+        actors = [dict(self.new_actor, age=age) for age in (30, 30, 30, 20, 40)]
+        self.client().post('/actors/bulk', headers=self.headers, json=actors)
+        seen = []
+        cursor = ''
+
+        while cursor is not None:
+            res = self.client().get('/actors?sort=age&limit=2&after=%s' % cursor, headers=self.headers)
+            data = json.loads(res.data)
+            seen.extend((actor['age'], actor['id']) for actor in data['actors'])
+            cursor = data['next_cursor']
+
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen), 6)
+
+    def testSortedKeysetWrongSort(self):
+        self.client().post('/actors/bulk', headers=self.headers, json=[self.new_actor] * 3)
+        first = json.loads(self.client().get('/actors?sort=age&limit=2&after=', headers=self.headers).data)
+        res = self.client().get('/actors?sort=name&after=%s' % first['next_cursor'], headers=self.headers)
+
+        self.assertEqual(res.status_code, 400)
+
+    def testBadSortAndFilter(self):
+        for path in ('/actors?sort=year', '/movies?order=up', '/movies?year_min=old', '/actors?gender=male'):
+            res = self.client().get(path, headers=self.headers)
+
+            self.assertEqual(res.status_code, 400, path)
+
+    def testFilterPlansUseIndexes(self):
+        self.seed_catalog(20000)
+        plans = {
+            'ix_movies_year': self.explain('/movies?year_min=1990&year_max=1995&sort=year', 'movies'),
+            'ix_movies_name': self.explain('/movies?sort=name&order=desc', 'movies'),
+            'ix_actors_gender_age': self.explain('/actors?gender=f&age_min=30&age_max=40&sort=age', 'actors'),
+            'ix_actors_name': self.explain('/actors?sort=name&after=', 'actors')
+        }
+
+        for index, plan in plans.items():
+            self.assertIn(index, plan)
+            self.assertNotIn('Seq Scan', plan)
+
+    def search(self, query, **params):
+        params = dict({'type': 'actors', 'q': query}, **params)
+        res = self.client().get('/search', headers=self.headers, query_string=params)
+
+        return res, json.loads(res.data)
+
+    def seed_graph(self):
+        actors = [dict(self.new_actor, name=name) for name in ('Meryl Streep', 'Tilda Swinton', 'Viola Davis')]
+        self.client().post('/actors/bulk', headers=self.headers, json=actors)
+        self.client().post('/movies/bulk', headers=self.headers, json=[{'name': 'Sully', 'year': 2016}])
+        self.client().post('/movies/1/cast', headers=self.headers, json={'actors': [1, 2]})
+        self.client().post('/movies/2/cast', headers=self.headers, json={'actors': [2, 3]})
+
+    def testCostars(self):
+        self.seed_graph()
+        self.client().post('/movies/bulk', headers=self.headers, json=[{'name': 'Doubt', 'year': 2008}])
+        self.client().post('/movies/3/cast', headers=self.headers, json={'actors': [2, 3]})
+        res = self.client().get('/actors/2/costars', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([(actor['id'], actor['sharedMovies']) for actor in data['costars']], [(3, 2), (1, 1)])
+
+    def testCostarsNotFound(self):
+        res = self.client().get('/actors/99/costars', headers=self.headers)
+
+        self.assertEqual(res.status_code, 404)
+
+    def testPath(self):
+        self.seed_graph()
+        res = self.client().get('/actors/1/path/3', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['degrees'], 2)
+        self.assertEqual([actor['id'] for actor in data['actors']], [1, 2, 3])
+        self.assertEqual([movie['id'] for movie in data['movies']], [1, 2])
+        self.assertFalse(data['truncated'])
+
+    def testPathFollowsCastChanges(self):
+        self.seed_graph()
+        self.client().get('/actors/1/path/3', headers=self.headers)
+        self.client().delete('/movies/1/cast', headers=self.headers, json={'actors': [2]})
+        data = json.loads(self.client().get('/actors/1/path/3', headers=self.headers).data)
+
+        self.assertIsNone(data['actors'])
+        self.assertIsNone(data['degrees'])
+        self.assertFalse(data['truncated'])
+
+        self.client().delete('/actors/2', headers=self.headers)
+        self.client().post('/movies/1/cast', headers=self.headers, json={'actors': [3]})
+        data = json.loads(self.client().get('/actors/1/path/3', headers=self.headers).data)
+
+        self.assertEqual([actor['id'] for actor in data['actors']], [1, 3])
+
+    def testPathDepthLimit(self):
+        self.seed_graph()
+        data = json.loads(self.client().get('/actors/1/path/3?max_depth=1', headers=self.headers).data)
+
+        self.assertIsNone(data['actors'])
+        self.assertTrue(data['truncated'])
+
+    def testPathNotFound(self):
+        res = self.client().get('/actors/1/path/99', headers=self.headers)
+
+        self.assertEqual(res.status_code, 404)
+
+    def get_stats(self):
+        res = self.client().get('/stats', headers=self.headers)
+
+        return res, json.loads(res.data)
+
+    def testStats(self):
+        self.app.config['STATS_MAX_AGE'] = 0
+        self.seed_graph()
+        res, data = self.get_stats()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertFalse(data['stale'])
+        self.assertEqual(data['stats'], {
+            'movies': 2,
+            'actors': 4,
+            'casts': 4,
+            'movies_per_year': {'2016': 1, '2021': 1},
+            'actors_per_age_group': {'50': 3, '60': 1},
+            'actors_per_gender': {'f': 1, 'm': 3},
+            'average_cast_size': 2.0
+        })
+
+    def testStatsStalenessBound(self):
+        res, data = self.get_stats()
+
+        # Refreshed with the empty tables, the seed rows are younger than STATS_MAX_AGE
+        self.assertTrue(data['stale'])
+        self.assertEqual(data['stats']['actors'], 0)
+
+        self.app.config['STATS_MAX_AGE'] = 0
+        res, data = self.get_stats()
+
+        self.assertFalse(data['stale'])
+        self.assertEqual(data['stats']['actors'], 1)
+
+    def testStatsServedWhileRefreshing(self):
+        self.app.config['STATS_MAX_AGE'] = 0
+
+        with self.app.app_context():
+            with db.engine.connect() as connection:
+                connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': STATS_LOCK})
+                res, data = self.get_stats()
+                connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': STATS_LOCK})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['stale'])
+
+    def testStatsReadOneRow(self):
+        self.app.config['STATS_MAX_AGE'] = 0
+        self.get_stats()
+        res, statements = self.count_queries(self.client().get, '/stats', headers=self.headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(statements, 1)
+
+    def testJsonProviders(self):
+        self.client().post('/actors', headers=self.headers, json=dict(self.new_actor, name='Zoë Saldaña'))
+        bodies = []
+
+        for provider in (StdlibProvider(), make_provider()):
+            self.app.extensions['json_provider'] = provider
+            response_cache.clear()
+            res = self.client().get('/actors?ids=1,2', headers=self.headers)
+            bodies.append(res.data)
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.mimetype, 'application/json')
+
+        self.assertEqual(bodies[0], bodies[1])
+        self.assertEqual(json.loads(bodies[0])['actors'][1]['name'], 'Zoë Saldaña')
+
+    def statements_of(self, path):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.app.app_context():
+            engine = db.engine
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+
+        try:
+            res = self.client().get(path, headers=self.headers)
+
+        finally:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+        return res, statements
+
+    def testSparseFields(self):
+        res, statements = self.statements_of('/movies?fields=year')
+        data = json.loads(res.data)
+        selects = [statement for statement in statements if 'FROM movies' in statement and 'count(' not in statement]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['movies'], [{'id': 1, 'release': 2021}])
+        self.assertIn('movies.year', selects[0])
+        self.assertNotIn('movies.name', selects[0])
+
+    def testSparseFieldsCursor(self):
+        actors = [dict(self.new_actor, name='Actor %d' % age, age=age) for age in (30, 20, 40)]
+        self.client().post('/actors/bulk', headers=self.headers, json=actors)
+        first = json.loads(self.client().get('/actors?fields=name&sort=age&after=&limit=2', headers=self.headers).data)
+        second = json.loads(self.client().get('/actors?fields=name&sort=age&limit=2&after=' + first['next_cursor'], headers=self.headers).data)
+
+        self.assertEqual(first['actors'], [{'id': 3, 'name': 'Actor 20'}, {'id': 2, 'name': 'Actor 30'}])
+        self.assertEqual([actor['name'] for actor in second['actors']], ['Actor 40', 'Tom Hanks'])
+
+    def testSparseFieldsMultiGet(self):
+        res = self.client().get('/actors?ids=1,9&fields=gender,name', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(data['actors'], [{'id': 1, 'name': 'Tom Hanks', 'gender': 'f'}])
+        self.assertEqual(data['missing'], [9])
+
+    def testSparseFieldsWithCast(self):
+        self.client().post('/movies/1/cast', headers=self.headers, json={'actors': [1]})
+        data = json.loads(self.client().get('/movies/1/cast', headers=self.headers).data)
+        res = self.client().get('/movies?fields=name&include=cast', headers=self.headers)
+        movies = json.loads(res.data)['movies']
+
+        self.assertEqual(movies, [{'id': 1, 'name': 'Fink', 'cast': data['actors']}])
+
+    def testSparseFieldsExport(self):
+        res = self.client().get('/export/actors?format=csv&fields=name', headers=self.headers)
+
+        self.assertEqual(res.data.decode().splitlines(), ['id,name', '1,Tom Hanks'])
+
+    def testBadRequestFields(self):
+        for path in ('/actors?fields=year', '/movies?fields=age', '/export/movies?fields=cast'):
+            res = self.client().get(path, headers=self.headers)
+
+            self.assertEqual(res.status_code, 400, path)
+
+    def testSearchPrefix(self):
+        names = ['Tom Holland', 'Thomas Newman', 'Sandra Bullock']
+        self.client().post('/actors/bulk', headers=self.headers, json=[dict(self.new_actor, name=name) for name in names])
+        res, data = self.search('tom', prefix='true')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(actor['name'] for actor in data['results']), ['Tom Hanks', 'Tom Holland'])
+
+    def testSearchFuzzy(self):
+        self.client().post('/movies/bulk', headers=self.headers, json=[{'name': 'Bird Box', 'year': 2018}])
+        res, data = self.search('bird bx', type='movies')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([movie['name'] for movie in data['results']], ['Bird Box'])
+
+    def testSearchFollowsWrites(self):
+        self.search('hanks')
+        created = json.loads(self.client().post('/actors', headers=self.headers, json=self.new_actor).data)
+        self.client().delete('/actors/1', headers=self.headers)
+        res, data = self.search('sandra', prefix='true')
+        res, gone = self.search('hanks')
+
+        self.assertEqual([actor['id'] for actor in data['results']], [created['actor']['id']])
+        self.assertEqual(gone['results'], [])
+
+    def testSearchBadRequest(self):
+        for params in ({'q': ''}, {'type': 'casts'}, {'q': 'x' * 101}):
+            res, data = self.search('tom', **params)
+
+            self.assertEqual(res.status_code, 400, params)
+
+    def testSearchPlanUsesTrigramIndex(self):
+        with self.app.app_context():
+            if not has_extension('pg_trgm'):
+                self.skipTest('pg_trgm is not installed')
+
+        self.seed_catalog(20000)
+        plan = self.explain('/search?type=actors&q=actor%201234&prefix=true', 'actors')
+
+        self.assertIn('ix_actors_name_trgm', plan)
+
+    def testCommitsPerRequest(self):
+        actors = [dict(self.new_actor, age=age) for age in range(30, 40)]
+        res = self.client().post('/actors/bulk', headers=self.headers, json=actors)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['X-DB-Commits'], '1')
+
+        res = self.client().get('/actors', headers=self.headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['X-DB-Commits'], '0')
+
+    def testUnitOfWork(self):
+        with self.app.app_context():
+            with unit_of_work():
+                for age in range(30, 33):
+                    Actor(name='Actor %d' % age, age=age, gender='f').insert()
+
+            self.assertEqual(commit_count(), 1)
+            self.assertEqual(Actor.query.count(), 4)
+
+    def testUnitOfWorkRollback(self):
+        with self.app.app_context():
+            with self.assertRaises(ValueError):
+                with unit_of_work():
+                    Actor(name='Actor 30', age=30, gender='f').insert()
+                    Movie(name='Movie 2000', year=2000).insert()
+                    raise ValueError('batch failed')
+
+            self.assertEqual(commit_count(), 0)
+            self.assertEqual(Actor.query.count(), 1)
+            self.assertEqual(Movie.query.count(), 1)
+
+    def testNestedUnitOfWorkFailure(self):
+        published = []
+        on_change(published.extend)
+        self.addCleanup(change_listeners.remove, published.extend)
+
+        with self.app.app_context():
+            with unit_of_work():
+                Actor(name='Actor 30', age=30, gender='f').insert()
+
+                with self.assertRaises(ValueError):
+                    with unit_of_work():
+                        Movie(name='Movie 2000', year=2000).insert()
+                        raise ValueError('inner batch failed')
+
+                with self.assertRaises(IntegrityError):
+                    with unit_of_work():
+                        Cast(movie_id=100, actor_id=1).insert()
+
+                Actor(name='Actor 31', age=31, gender='f').insert()
+
+            self.assertEqual(commit_count(), 1)
+            self.assertEqual(Actor.query.count(), 3)
+            self.assertEqual(Movie.query.count(), 1)
+            self.assertEqual(Cast.query.count(), 0)
+
+        self.assertEqual(set(table for table, op, ids in published), {'actors'})
+
+    def testExportActors(self):
+        with self.app.app_context():
+            for age in range(20, 25):
+                Actor(name='Actor %d' % age, age=age, gender='f').insert()
+
+        res = self.client().get('/export/actors', headers=self.headers)
+        rows = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual([row['age'] for row in rows], [65, 20, 21, 22, 23, 24])
+
+    def testExportMoviesCSV(self):
+        res = self.client().get('/export/movies?format=csv', headers=self.headers)
+        lines = res.data.decode().splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/csv')
+        self.assertEqual(lines, ['id,name,release', '1,Fink,2021'])
+
+    def testExportCasts(self):
+        with self.app.app_context():
+            Cast(movie_id=1, actor_id=1).insert()
+
+        res = self.client().get('/export/casts', headers=self.headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data), {'movie_id': 1, 'actor_id': 1})
+
+    def testBadRequestExport(self):
+        res = self.client().get('/export/movies?format=xml', headers=self.headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,12 +1,25 @@
 import os
 import json
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
 from flask import request
 from functools import wraps
 from jose import jwt
+from jose.exceptions import JWTError
 from urllib.request import urlopen
 
 
 ALGORITHMS = ['RS256']
+JWKS_TTL = int(os.environ.get('AUTH0_JWKS_TTL', 3600))
+JWKS_MIN_REFRESH_INTERVAL = int(os.environ.get('AUTH0_JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_REFRESH_INTERVAL = int(os.environ.get('AUTH0_JWKS_REFRESH_INTERVAL', 0))
+TOKEN_CACHE_SIZE = int(os.environ.get('AUTH0_TOKEN_CACHE_SIZE', 1024))
+TOKEN_CACHE_TTL = int(os.environ.get('AUTH0_TOKEN_CACHE_TTL', 300))
+
+logger = logging.getLogger(__name__)
 
 '''
 Authentication Error
@@ -70,20 +83,33 @@ def check_permissions(permission, payload):
     return True
 
 
-def verify_decode_jwt(token):
-    jsonurl = urlopen(os.environ['AUTH0_DOMAIN'])
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
+'''
+JWKS Key Store
+Keeps the Auth0 signing keys indexed by kid, so requests
+don't pay a round trip to Auth0 before verifying a token
+
+'''
 
-    if 'kid' not in unverified_header:
-        raise AuthError({
-            'code': 'invalid_header',
-            'description': 'Authorization malformed'}, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
+class JWKSKeyStore:
+    def __init__(self, url=None, ttl=JWKS_TTL, min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.keys = {}
+        self.fetched_at = None
+        self.fetches = 0
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._stop = None
+
+    def fetch(self):
+        jsonurl = urlopen(self.url or os.environ['AUTH0_DOMAIN'])
+        jwks = json.loads(jsonurl.read())
+        keys = {}
+
+        for key in jwks['keys']:
+            keys[key['kid']] = {
                 'kty': key['kty'],
                 'kid': key['kid'],
                 'use': key['use'],
@@ -91,6 +117,178 @@ def verify_decode_jwt(token):
                 'e': key['e']
             }
 
+        return keys
+
+    def age(self):
+        if self.fetched_at is None:
+            return None
+
+        return time.monotonic() - self.fetched_at
+
+    def is_fresh(self):
+        age = self.age()
+
+        return age is not None and age < self.ttl
+
+    def refresh(self, force=False):
+        generation = self.generation
+
+        with self._lock:
+            # Another request already fetched the keys while this one
+            # was waiting for the lock, so share its result
+            if self.generation != generation:
+                return
+
+            if not force and self.is_fresh():
+                return
+
+            try:
+                self.fetches += 1
+                keys = self.fetch()
+
+            except Exception:
+                if not self.keys:
+                    raise
+
+                # Keep serving the last known keys and retry later
+                logger.exception('Unable to refresh JWKS, keeping cached keys')
+                self.fetched_at = time.monotonic() - self.ttl + self.min_refresh_interval
+                return
+
+            self.keys = keys
+            self.fetched_at = time.monotonic()
+            self.generation += 1
+
+    def get_key(self, kid):
+        if not self.is_fresh():
+            self.refresh()
+
+        key = self.keys.get(kid)
+
+        # Unknown kid usually means Auth0 rotated its keys, refresh
+        # once but never more often than min_refresh_interval
+        if key is None and self.age() >= self.min_refresh_interval:
+            self.refresh(force=True)
+            key = self.keys.get(kid)
+
+        return key
+
+    def start_background_refresh(self, interval=JWKS_REFRESH_INTERVAL):
+        if self._stop is not None or interval <= 0:
+            return
+
+        self._stop = threading.Event()
+        stop = self._stop
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.refresh(force=True)
+
+                except Exception:
+                    logger.exception('Background JWKS refresh failed')
+
+        thread = threading.Thread(target=run, name='jwks-refresh', daemon=True)
+        thread.start()
+
+    def stop_background_refresh(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+
+jwks_store = JWKSKeyStore()
+
+
+'''
+Verified Token Cache
+LRU of decoded payloads keyed by a hash of the token, so
+repeated bearer tokens skip the RSA signature verification
+
+'''
+
+
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        key = self.key(token)
+
+        with self._lock:
+            entry = self.entries.get(key)
+
+            if entry is not None and entry[1] <= time.time():
+                del self.entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        return dict(entry[0])
+
+    def put(self, token, payload):
+        expires_at = time.time() + self.ttl
+
+        if isinstance(payload.get('exp'), (int, float)):
+            expires_at = min(expires_at, payload['exp'])
+
+        if self.maxsize <= 0 or expires_at <= time.time():
+            return
+
+        key = self.key(token)
+
+        with self._lock:
+            self.entries[key] = (dict(payload), expires_at)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+token_cache = TokenCache()
+
+
+def verify_decode_jwt(token):
+    payload = token_cache.get(token)
+
+    if payload is not None:
+        return payload
+
+    unverified_header = jwt.get_unverified_header(token)
+
+    if 'kid' not in unverified_header:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization malformed'}, 401)
+
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
+
     if rsa_key:
         try:
             issuer = os.environ['AUTH0_DOMAIN']
@@ -102,6 +300,7 @@ def verify_decode_jwt(token):
                 issuer=issuer[0:-21],
                 options={'verify_exp': False}
             )
+            token_cache.put(token, payload)
 
             return payload
 
@@ -125,6 +324,15 @@ def verify_decode_jwt(token):
         'description': 'Unable to find the appropriate key'}, 400)
 
 
+def token_subject():
+    # The verified 'sub' of the request's token, None when there is no valid one
+    try:
+        return verify_decode_jwt(get_token_auth_header()).get('sub')
+
+    except (AuthError, JWTError):
+        return None
+
+
 '''
 Auth Decorator
 
@@ -145,7 +353,9 @@ def requires_auth(permission=''):
                     "code": "Unauthorized",
                     "description": "Unauthorized"}, 401)
 
-            check_permissions(permission, payload)
+            # Routes that need different permissions per request check them themselves
+            if permission:
+                check_permissions(permission, payload)
 
             return f(payload, *args, **kwargs)
 
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+import rsa
+from flask import Flask
+from jose import jwk, jwt
+from . import auth0
+from .auth0 import JWKSKeyStore, TokenCache
+
+
+def jwks_document(*kids):
+    return {
+        'keys': [
+            {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'modulus-' + kid, 'e': 'AQAB'}
+            for kid in kids
+        ]
+    }
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'jwks.json')
+        self.write_jwks('first')
+        self.store = JWKSKeyStore(url='file://' + self.path, ttl=60, min_refresh_interval=0)
+
+    def tearDown(self):
+        self.store.stop_background_refresh()
+        self.directory.cleanup()
+
+    def write_jwks(self, *kids):
+        with open(self.path, 'w') as jwks_file:
+            json.dump(jwks_document(*kids), jwks_file)
+
+    def testCachedKeys(self):
+        first = self.store.get_key('first')
+        second = self.store.get_key('first')
+
+        self.assertEqual(first['n'], 'modulus-first')
+        self.assertEqual(first, second)
+        self.assertEqual(self.store.fetches, 1)
+
+    def testExpiredKeys(self):
+        self.store.get_key('first')
+        self.store.fetched_at -= self.store.ttl + 1
+        self.write_jwks('second')
+
+        self.assertIsNone(self.store.get_key('first'))
+        self.assertEqual(self.store.get_key('second')['kid'], 'second')
+        self.assertEqual(self.store.fetches, 3)
+
+    def testRotatedKey(self):
+        self.store.get_key('first')
+        self.write_jwks('first', 'second')
+
+        self.assertEqual(self.store.get_key('second')['kid'], 'second')
+        self.assertEqual(self.store.fetches, 2)
+
+    def testUnknownKid(self):
+        self.store.get_key('first')
+
+        self.assertIsNone(self.store.get_key('unknown'))
+        self.assertEqual(self.store.fetches, 2)
+
+    def testUnknownKidRateLimited(self):
+        self.store.min_refresh_interval = 60
+        self.store.get_key('first')
+
+        self.assertIsNone(self.store.get_key('unknown'))
+        self.assertIsNone(self.store.get_key('unknown'))
+        self.assertEqual(self.store.fetches, 1)
+
+    def testStaleKeysOnFetchError(self):
+        self.store.get_key('first')
+        self.store.fetched_at -= self.store.ttl + 1
+        os.remove(self.path)
+
+        self.assertEqual(self.store.get_key('first')['kid'], 'first')
+        self.assertEqual(self.store.fetches, 2)
+
+    def testBackgroundRefresh(self):
+        self.store.get_key('first')
+        self.write_jwks('second')
+        self.store.start_background_refresh(interval=0.01)
+
+        deadline = time.monotonic() + 5
+        while 'second' not in self.store.keys and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertIn('second', self.store.keys)
+
+    def testConcurrentFetch(self):
+        hits = []
+
+        class SlowJWKSHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                hits.append(self.path)
+                time.sleep(0.2)
+                body = json.dumps(jwks_document('first')).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), SlowJWKSHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        store = JWKSKeyStore(url='http://127.0.0.1:%d/.well-known/jwks.json' % server.server_port)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(store.get_key('first')))
+            for _ in range(8)
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(store.fetches, 1)
+        self.assertTrue(all(key['kid'] == 'first' for key in results))
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = TokenCache(maxsize=2, ttl=60)
+
+    def testHitAndMiss(self):
+        self.assertIsNone(self.cache.get('token'))
+        self.cache.put('token', {'sub': 'user', 'exp': time.time() + 60})
+
+        self.assertEqual(self.cache.get('token')['sub'], 'user')
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def testLeastRecentlyUsedEviction(self):
+        self.cache.put('first', {'sub': 'first'})
+        self.cache.put('second', {'sub': 'second'})
+        self.cache.get('first')
+        self.cache.put('third', {'sub': 'third'})
+
+        self.assertIsNotNone(self.cache.get('first'))
+        self.assertIsNone(self.cache.get('second'))
+        self.assertEqual(self.cache.stats()['size'], 2)
+
+    def testEvictedAtExp(self):
+        self.cache.put('expired', {'sub': 'user', 'exp': time.time() - 1})
+        self.cache.put('expiring', {'sub': 'user', 'exp': time.time() + 0.05})
+        time.sleep(0.1)
+
+        self.assertIsNone(self.cache.get('expired'))
+        self.assertIsNone(self.cache.get('expiring'))
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def testKeyedByHash(self):
+        self.cache.put('secret-token', {'sub': 'user'})
+
+        self.assertNotIn('secret-token', self.cache.entries)
+        self.assertIn(TokenCache.key('secret-token'), self.cache.entries)
+
+    def testVerifiedTokenSkipsSignatureCheck(self):
+        public_key, private_key = rsa.newkeys(1024)
+        key = jwk.construct(private_key.save_pkcs1(), 'RS256').public_key().to_dict()
+        key.update({'kid': 'test', 'use': 'sig'})
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, '.well-known', 'jwks.json')
+        os.makedirs(os.path.dirname(path))
+
+        with open(path, 'w') as jwks_file:
+            json.dump({'keys': [key]}, jwks_file)
+
+        domain = 'file://' + path
+        token = jwt.encode({
+            'iss': domain[0:-21],
+            'aud': 'audience',
+            'exp': time.time() + 60,
+            'permissions': ['get:actors']
+        }, private_key.save_pkcs1(), algorithm='RS256', headers={'kid': 'test'})
+
+        environ = {'AUTH0_DOMAIN': domain, 'AUTH0_AUDIENCE': 'audience'}
+
+        with mock.patch.dict(os.environ, environ), \
+                mock.patch.object(auth0, 'jwks_store', JWKSKeyStore()), \
+                mock.patch.object(auth0, 'token_cache', self.cache), \
+                mock.patch.object(auth0.jwt, 'decode', wraps=auth0.jwt.decode) as decode:
+            first = auth0.verify_decode_jwt(token)
+            second = auth0.verify_decode_jwt(token)
+
+        self.assertEqual(first, second)
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+
+
+class RequiresAuthTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+
+        @self.app.route('/open')
+        @auth0.requires_auth()
+        def open_route(payload):
+            return 'ok'
+
+        @self.app.route('/closed')
+        @auth0.requires_auth('get:actors')
+        def closed_route(payload):
+            return 'ok'
+
+        @self.app.errorhandler(auth0.AuthError)
+        def handle_auth_error(ex):
+            return ex.error['code'], ex.status_code
+
+    def get(self, path):
+        payload = {'permissions': []}
+
+        with mock.patch.object(auth0, 'verify_decode_jwt', return_value=payload):
+            return self.app.test_client().get(path, headers={'Authorization': 'Bearer token'})
+
+    def testEmptyPermissionSkipsCheck(self):
+        self.assertEqual(self.get('/open').status_code, 200)
+
+    def testPermissionChecked(self):
+        self.assertEqual(self.get('/closed').status_code, 403)
+
+    def testTokenStillRequired(self):
+        res = self.app.test_client().get('/open')
+
+        self.assertEqual(res.status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
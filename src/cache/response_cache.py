@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_URL = os.environ.get('CACHE_URL', 'redis://localhost:6379/0')
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 32 * 1024 * 1024))
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 60))
+
+logger = logging.getLogger(__name__)
+
+'''
+In-process backend
+LRU bounded by the bytes it holds, private to each worker
+
+'''
+
+
+class MemoryBackend:
+    errors = ()
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.bytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            if entry[1] <= time.monotonic():
+                self._remove(key)
+                return None
+
+            self.entries.move_to_end(key)
+
+        return entry[0]
+
+    def set(self, key, value, ttl):
+        size = len(key) + len(value)
+
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        value, expires_at = self.entries.pop(key)
+        self.bytes -= len(key) + len(value)
+
+    def get_versions(self, tags):
+        with self._lock:
+            return [self.versions.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self.versions[tag] = self.versions.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            'backend': 'memory',
+            'entries': len(self.entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions
+        }
+
+
+'''
+Redis backend
+Shared by every gunicorn worker. Entries expire with CACHE_TTL and
+versions never do, so run Redis with maxmemory-policy volatile-lru
+
+'''
+
+
+class RedisBackend:
+    def __init__(self, url=CACHE_URL, prefix='response-cache:'):
+        # Only needed when CACHE_BACKEND=redis
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.errors = (redis.RedisError,)
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+    def version_key(self, tag):
+        return self.prefix + 'version:' + tag
+
+    def get_versions(self, tags):
+        versions = self.client.mget([self.version_key(tag) for tag in tags])
+
+        return [int(version or 0) for version in versions]
+
+    def bump(self, tags):
+        pipeline = self.client.pipeline(transaction=False)
+
+        for tag in tags:
+            pipeline.incr(self.version_key(tag))
+
+        pipeline.execute()
+
+    def clear(self):
+        keys = [key for key in self.client.scan_iter(self.prefix + '*') if b':version:' not in key]
+
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        memory = self.client.info('memory')
+
+        return {
+            'backend': 'redis',
+            'bytes': memory['used_memory'],
+            'max_bytes': memory.get('maxmemory', 0)
+        }
+
+
+def make_backend(name=CACHE_BACKEND):
+    if name == 'memory':
+        return MemoryBackend()
+
+    if name == 'redis':
+        return RedisBackend()
+
+    return None
+
+
+'''
+Response Cache
+Rendered JSON bytes keyed by path, query string and the current
+version of every table or row tag the response was built from.
+A committed write bumps its tags, so older entries are never read again.
+Short-lived flags, such as read-your-writes pins, share the backend so
+every worker sees them, or live in this worker when caching is off
+
+'''
+
+
+class ResponseCache:
+    def __init__(self, backend=None, ttl=CACHE_TTL):
+        self.backend = backend
+        self.flags = backend if backend is not None else MemoryBackend(max_bytes=1024 * 1024)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    def key(self, path, args, tags, extra=()):
+        try:
+            versions = self.backend.get_versions(tags)
+
+        except self.backend.errors:
+            logger.exception('Response cache unavailable')
+            self.errors += 1
+            return None
+
+        raw = json.dumps([path, sorted(args), list(zip(tags, versions)), list(extra)])
+
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        try:
+            value = self.backend.get(key)
+
+        except self.backend.errors:
+            logger.exception('Response cache unavailable')
+            self.errors += 1
+            value = None
+
+        if value is None:
+            self.misses += 1
+
+        else:
+            self.hits += 1
+
+        return value
+
+    def put(self, key, value):
+        try:
+            self.backend.set(key, value, self.ttl)
+
+        except self.backend.errors:
+            logger.exception('Response cache unavailable')
+            self.errors += 1
+
+    def flag(self, name, ttl):
+        try:
+            self.flags.set('flag:' + name, b'1', ttl)
+
+        except self.flags.errors:
+            logger.exception('Response cache unavailable')
+            self.errors += 1
+
+    def flagged(self, name):
+        try:
+            return self.flags.get('flag:' + name) is not None
+
+        except self.flags.errors:
+            logger.exception('Response cache unavailable')
+            self.errors += 1
+            return False
+
+    def invalidate(self, changes):
+        if not self.enabled or not changes:
+            return
+
+        tags = set()
+
+        for table, op, ids in changes:
+            tags.add(table)
+
+            if ids is None:
+                tags.add(table + ':*')
+
+            else:
+                tags.update('%s:%s' % (table, row_id) for row_id in ids)
+
+        try:
+            self.backend.bump(sorted(tags))
+
+        except self.backend.errors:
+            logger.exception('Response cache unavailable')
+            self.errors += 1
+
+    def clear(self):
+        if self.enabled:
+            self.backend.clear()
+
+    def stats(self):
+        if not self.enabled:
+            return {'backend': None}
+
+        lookups = self.hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'errors': self.errors
+        }
+
+        try:
+            stats.update(self.backend.stats())
+
+        except self.backend.errors:
+            self.errors += 1
+
+        return stats
+
+
+response_cache = ResponseCache(make_backend())
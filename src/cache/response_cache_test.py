@@ -0,0 +1,142 @@
+import os
+import time
+import unittest
+from .response_cache import MemoryBackend, RedisBackend, ResponseCache
+
+
+class MemoryBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backend = MemoryBackend(max_bytes=20)
+
+    def testGetAndSet(self):
+        self.assertIsNone(self.backend.get('a'))
+        self.backend.set('a', b'first', 60)
+
+        self.assertEqual(self.backend.get('a'), b'first')
+        self.assertEqual(self.backend.stats()['bytes'], 6)
+
+    def testExpiredEntry(self):
+        self.backend.set('a', b'first', 0.05)
+        time.sleep(0.1)
+
+        self.assertIsNone(self.backend.get('a'))
+        self.assertEqual(self.backend.stats()['bytes'], 0)
+
+    def testEvictedByBytes(self):
+        self.backend.set('a', b'123456', 60)
+        self.backend.set('b', b'123456', 60)
+        self.backend.get('a')
+        self.backend.set('c', b'123456', 60)
+
+        self.assertIsNotNone(self.backend.get('a'))
+        self.assertIsNone(self.backend.get('b'))
+        self.assertLessEqual(self.backend.stats()['bytes'], 20)
+        self.assertEqual(self.backend.stats()['evictions'], 1)
+
+    def testLargeEntrySkipped(self):
+        self.backend.set('a', b'x' * 100, 60)
+
+        self.assertIsNone(self.backend.get('a'))
+
+    def testVersions(self):
+        self.backend.bump(['actors', 'actors'])
+
+        self.assertEqual(self.backend.get_versions(['actors', 'movies']), [2, 0])
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResponseCache(MemoryBackend())
+
+    def testHitRatio(self):
+        key = self.cache.key('/actors', [], ['actors'])
+        self.cache.get(key)
+        self.cache.put(key, b'{}')
+
+        self.assertEqual(self.cache.get(key), b'{}')
+        self.assertEqual(self.cache.stats()['hit_ratio'], 0.5)
+
+    def testKeyedByQuery(self):
+        first = self.cache.key('/actors', [('page', '1')], ['actors'])
+        second = self.cache.key('/actors', [('page', '2')], ['actors'])
+
+        self.assertNotEqual(first, second)
+
+    def testTableChange(self):
+        before = self.cache.key('/actors', [], ['actors'])
+        self.cache.invalidate([('actors', 'insert', [2])])
+
+        self.assertNotEqual(self.cache.key('/actors', [], ['actors']), before)
+
+    def testRowChange(self):
+        changed = self.cache.key('/actors/1', [], ['actors:1', 'actors:*'])
+        unchanged = self.cache.key('/actors/2', [], ['actors:2', 'actors:*'])
+        self.cache.invalidate([('actors', 'update', [1])])
+
+        self.assertNotEqual(self.cache.key('/actors/1', [], ['actors:1', 'actors:*']), changed)
+        self.assertEqual(self.cache.key('/actors/2', [], ['actors:2', 'actors:*']), unchanged)
+
+    def testUnknownRowsChange(self):
+        before = self.cache.key('/actors/2', [], ['actors:2', 'actors:*'])
+        self.cache.invalidate([('actors', 'update', None)])
+
+        self.assertNotEqual(self.cache.key('/actors/2', [], ['actors:2', 'actors:*']), before)
+
+    def testFlags(self):
+        self.cache.flag('primary:a', 60)
+        self.cache.flag('primary:b', 0.05)
+        time.sleep(0.1)
+
+        self.assertTrue(self.cache.flagged('primary:a'))
+        self.assertFalse(self.cache.flagged('primary:b'))
+        self.assertFalse(self.cache.flagged('primary:c'))
+
+    def testFlagsWithoutBackend(self):
+        cache = ResponseCache(None)
+        cache.flag('primary:a', 60)
+
+        self.assertTrue(cache.flagged('primary:a'))
+
+    def testDisabled(self):
+        cache = ResponseCache(None)
+        cache.invalidate([('actors', 'insert', [1])])
+
+        self.assertFalse(cache.enabled)
+        self.assertEqual(cache.stats(), {'backend': None})
+
+
+@unittest.skipUnless(os.environ.get('CACHE_URL'), 'CACHE_URL is not set')
+class RedisBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backend = RedisBackend(prefix='response-cache-test:')
+        self.addCleanup(self.cleanup)
+
+    def cleanup(self):
+        keys = list(self.backend.client.scan_iter('response-cache-test:*'))
+
+        if keys:
+            self.backend.client.delete(*keys)
+
+    def testGetAndSet(self):
+        self.backend.set('a', b'first', 60)
+
+        self.assertEqual(self.backend.get('a'), b'first')
+        self.assertIsNone(self.backend.get('b'))
+
+    def testVersionsShared(self):
+        other = RedisBackend(prefix='response-cache-test:')
+        self.backend.bump(['actors'])
+
+        self.assertEqual(other.get_versions(['actors', 'movies']), [1, 0])
+
+    def testClearKeepsVersions(self):
+        self.backend.set('a', b'first', 60)
+        self.backend.bump(['actors'])
+        self.backend.clear()
+
+        self.assertIsNone(self.backend.get('a'))
+        self.assertEqual(self.backend.get_versions(['actors']), [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
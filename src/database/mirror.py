@@ -0,0 +1,73 @@
+import threading
+from datetime import timedelta
+from .models import db, table_versions, Tombstone
+
+
+SYNC_OVERLAP = timedelta(seconds=5)
+
+'''
+Table Mirror
+Keeps an in-process structure in step with one table. It checks the
+table version before each use and pulls only the rows changed or
+deleted since the last pull, the same way ?since= sync clients do.
+Subclasses say which columns they need and implement load and apply
+
+'''
+
+
+def latest(current, values):
+    values = [value for value in values if value is not None]
+
+    if current is not None:
+        values.append(current)
+
+    return max(values, default=None)
+
+
+class TableMirror:
+    def __init__(self, model, columns):
+        self.model = model
+        self.columns = columns
+        self.version = None
+        self.updated_at = None
+        self.deleted_at = None
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        raise NotImplementedError
+
+    def apply(self, rows, deleted_ids):
+        raise NotImplementedError
+
+    def refresh(self):
+        version = table_versions([self.model.__tablename__])[0]
+
+        if version == self.version:
+            return
+
+        model = self.model
+        tombstones = Tombstone.__table__
+        rows = db.session.query(*[getattr(model, column) for column in self.columns], model.updated_at)
+        deleted = db.session.query(tombstones.c.row_id, tombstones.c.deleted_at) \
+            .filter(tombstones.c.table_name == model.__tablename__)
+
+        if self.version is None:
+            rows = rows.all()
+            self.load(rows)
+            deleted = deleted.order_by(tombstones.c.deleted_at.desc()).limit(1).all()
+
+        else:
+            # Transactions commit after their updated_at, so look back a little
+            if self.updated_at is not None:
+                rows = rows.filter(model.updated_at > self.updated_at - SYNC_OVERLAP)
+
+            if self.deleted_at is not None:
+                deleted = deleted.filter(tombstones.c.deleted_at > self.deleted_at - SYNC_OVERLAP)
+
+            rows = rows.all()
+            deleted = deleted.all()
+            self.apply(rows, [row.row_id for row in deleted])
+
+        self.updated_at = latest(self.updated_at, [row.updated_at for row in rows])
+        self.deleted_at = latest(self.deleted_at, [row.deleted_at for row in deleted])
+        self.version = version
@@ -1,25 +1,397 @@
 import os
-from flask_sqlalchemy import SQLAlchemy
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 from flask_migrate import Migrate
-from sqlalchemy import Column, Integer, String, ForeignKey, UniqueConstraint
+from sqlalchemy import DDL, BigInteger, Column, DateTime, Integer, Index, String, ForeignKey, UniqueConstraint, event, func, orm, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool, QueuePool
 
-db = SQLAlchemy()
-db_path = os.environ['DATABASE_URL']
 
-if db_path.startswith("postgres://"):
-    db_path = db_path.replace("postgres://", "postgresql://", 1)
+def env_flag(name, default=False):
+    value = os.environ.get(name)
+
+    if value is None:
+        return default
+
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+DEBUG = env_flag('DEBUG')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = env_flag('DB_POOL_PRE_PING', True)
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 10))
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+DB_PGBOUNCER = env_flag('DB_PGBOUNCER')
+DB_REPLICA_CHECK_INTERVAL = int(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 10))
+DB_READ_YOUR_WRITES = int(os.environ.get('DB_READ_YOUR_WRITES', 5))
+
+
+def normalize_url(url):
+    url = url.strip()
+
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+
+    return url
+
+
+'''
+Connection pool
+QueuePool that also records how long callers waited
+for a connection, exposed through pool_stats()
+
+'''
+
+
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        start = time.monotonic()
+
+        try:
+            return super()._do_get()
+
+        finally:
+            waited = time.monotonic() - start
+            self.waits += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+
+
+'''
+Read replicas
+GET requests read from a replica chosen round-robin, skipping
+replicas that failed until they answer a health check again
+
+'''
+
+
+class ReplicaRouter:
+    def __init__(self, engines, check_interval=DB_REPLICA_CHECK_INTERVAL):
+        self.engines = engines
+        self.check_interval = check_interval
+        self.down = {}
+        self.reads = {engine: 0 for engine in engines}
+        self._next = itertools.count()
+
+        for engine in engines:
+            event.listen(engine, 'handle_error', self.handle_error)
+
+    def handle_error(self, context):
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    def mark_down(self, engine):
+        self.down[engine] = time.monotonic() + self.check_interval
+
+    def check(self, engine):
+        try:
+            with engine.connect() as connection:
+                connection.exec_driver_sql('SELECT 1')
+
+        except Exception:
+            self.mark_down(engine)
+            return False
+
+        self.down.pop(engine, None)
+
+        return True
+
+    def choose(self):
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._next) % len(self.engines)]
+            retry_at = self.down.get(engine)
+
+            if retry_at is None or (retry_at <= time.monotonic() and self.check(engine)):
+                self.reads[engine] += 1
+                return engine
+
+        return None
+
+    def stats(self):
+        now = time.monotonic()
+
+        return [{
+            'url': repr(engine.url),
+            'reads': self.reads[engine],
+            'healthy': self.down.get(engine, now) <= now
+        } for engine in self.engines]
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('db_replica') if has_app_context() else None
+
+        # Writes always go to the primary, even inside a GET
+        if replica is not None and not self._flushing and not getattr(clause, 'is_dml', False):
+            return replica
+
+        return super().get_bind(mapper, clause)
+
+
+class Database(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+
+        # PgBouncer in transaction mode can't keep session settings,
+        # so the timeout is set again at the start of each transaction
+        if DB_PGBOUNCER and DB_STATEMENT_TIMEOUT and engine.dialect.name == 'postgresql':
+            @event.listens_for(engine, 'begin')
+            def set_statement_timeout(connection):
+                connection.exec_driver_sql('SET LOCAL statement_timeout = %d' % DB_STATEMENT_TIMEOUT)
+
+        return engine
+
+
+def engine_options(database_path):
+    if DB_PGBOUNCER:
+        options = {'poolclass': NullPool}
+
+    else:
+        options = {
+            'poolclass': TimedQueuePool,
+            'pool_size': DB_POOL_SIZE,
+            'max_overflow': DB_MAX_OVERFLOW,
+            'pool_timeout': DB_POOL_TIMEOUT,
+            'pool_recycle': DB_POOL_RECYCLE
+        }
+
+    options['pool_pre_ping'] = DB_POOL_PRE_PING
+
+    if database_path.startswith('postgresql'):
+        connect_args = {'connect_timeout': DB_CONNECT_TIMEOUT}
+
+        if DB_STATEMENT_TIMEOUT and not DB_PGBOUNCER:
+            connect_args['options'] = '-c statement_timeout=%d' % DB_STATEMENT_TIMEOUT
+
+        options['connect_args'] = connect_args
+
+    return options
+
+
+db = Database()
+db_path = normalize_url(os.environ['DATABASE_URL'])
+replica_paths = [normalize_url(url) for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
 
 migrate = Migrate()
 
 
-def setup_db(app, database_path=db_path):
+def setup_db(app, database_path=db_path, replica_paths=replica_paths):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    app.config["DEBUG"] = True
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
+    app.config["DEBUG"] = DEBUG
     db.app = app
     db.init_app(app)
     migrate.init_app(app, db)
 
+    if replica_paths:
+        engines = [db.create_engine(make_url(url), engine_options(url)) for url in replica_paths]
+        app.extensions['replicas'] = ReplicaRouter(engines)
+
+    else:
+        app.extensions.pop('replicas', None)
+
+
+def use_replica(app):
+    router = app.extensions.get('replicas')
+    g.db_replica = router.choose() if router else None
+
+    return g.db_replica
+
+
+def replica_stats(app):
+    router = app.extensions.get('replicas')
+
+    return router.stats() if router else []
+
+
+def pool_stats():
+    pool = db.engine.pool
+    stats = {'pool': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0)
+        })
+
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            'waits': pool.waits,
+            'wait_time': round(pool.wait_time, 6),
+            'max_wait': round(pool.max_wait, 6)
+        })
+
+    return stats
+
+
+'''
+Unit of work
+Requests and batch jobs run in one transaction that is
+committed once at the end instead of on every model call.
+Nested units run in a savepoint, so one that fails is undone
+even when the caller catches the error and carries on
+
+'''
+
+work = threading.local()
+
+
+def in_unit_of_work():
+    return getattr(work, 'depth', 0) > 0
+
+
+def begin_unit_of_work():
+    if not in_unit_of_work():
+        work.depth = 0
+        work.pending = False
+        work.commits = 0
+        work.savepoints = []
+
+    else:
+        recorded = len(db.session.info.get('changes', []))
+        work.savepoints.append((db.session.begin_nested(), recorded))
+
+    work.depth += 1
+
+
+def end_unit_of_work(commit=True):
+    if not in_unit_of_work():
+        return
+
+    work.depth -= 1
+
+    if work.depth > 0:
+        savepoint, recorded = work.savepoints.pop()
+
+        if commit:
+            savepoint.commit()
+
+        else:
+            savepoint.rollback()
+
+            # Changes recorded inside the savepoint never happened
+            del db.session.info.get('changes', [])[recorded:]
+
+        return
+
+    pending = work.pending
+    work.pending = False
+
+    if commit and pending:
+        try:
+            db.session.commit()
+
+        except Exception:
+            db.session.rollback()
+            raise
+
+        work.commits += 1
+
+    else:
+        db.session.rollback()
+
+
+def reset_unit_of_work():
+    if in_unit_of_work():
+        work.depth = 1
+        work.savepoints = []
+        end_unit_of_work(commit=False)
+
+
+def commit_count():
+    return getattr(work, 'commits', 0)
+
+
+@contextmanager
+def unit_of_work():
+    begin_unit_of_work()
+
+    try:
+        yield db.session
+
+    except BaseException:
+        end_unit_of_work(commit=False)
+        raise
+
+    end_unit_of_work()
+
+
+def save():
+    if in_unit_of_work():
+        db.session.flush()
+        work.pending = True
+
+    else:
+        db.session.commit()
+
+
+'''
+Change recording
+Writes record the tables and rows they touched. Listeners
+are told once the transaction commits, never on rollback
+
+'''
+
+change_listeners = []
+
+
+def on_change(listener):
+    if listener not in change_listeners:
+        change_listeners.append(listener)
+
+    return listener
+
+
+def record_change(table, op, ids=None, session=None):
+    session = session or db.session
+    ids = None if ids is None else list(ids)
+    session.info.setdefault('changes', []).append((table, op, ids))
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def record_flushed_changes(session, flush_context):
+    for op, objects in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            if hasattr(obj, '__table__'):
+                record_change(obj.__table__.name, op, [obj.id], session)
+
+            # Casts of a deleted movie or actor go with ON DELETE CASCADE
+            if op == 'delete' and isinstance(obj, (Movie, Actor)):
+                record_change(Cast.__tablename__, op, None, session)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def publish_changes(session):
+    changes = session.info.pop('changes', [])
+
+    if changes:
+        for listener in change_listeners:
+            listener(changes)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def discard_changes(session):
+    session.info.pop('changes', None)
+
 
 '''
 Drops database tables and start with
@@ -47,6 +419,106 @@ def db_drop_and_create_all():
     movie.insert()
 
 
+'''
+Table versions
+One counter per table, bumped by a statement trigger in the
+same transaction as the write, so ETags can be checked
+without reading any rows
+
+'''
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
+BUMP_TABLE_VERSION = DDL('''
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO table_versions (name, version) VALUES (TG_TABLE_NAME, 1)
+    ON CONFLICT (name) DO UPDATE SET version = table_versions.version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+''')
+
+DROP_BUMP_TABLE_VERSION = DDL('DROP FUNCTION IF EXISTS bump_table_version()')
+
+VERSION_TRIGGER = DDL('''
+CREATE TRIGGER %(table)s_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %(table)s
+FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()
+''')
+
+event.listen(db.metadata, 'before_create', BUMP_TABLE_VERSION.execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'after_drop', DROP_BUMP_TABLE_VERSION.execute_if(dialect='postgresql'))
+
+
+'''
+Name search
+Trigram GiST indexes on the names when pg_trgm can be installed.
+Without it /search uses an in-process index instead
+
+'''
+
+CREATE_TRIGRAM = DDL('''
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION WHEN OTHERS THEN
+    RAISE NOTICE 'pg_trgm is not available, search uses the in-process index';
+END
+$$
+''')
+
+TRIGRAM_INDEX = DDL('''
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX ix_%(table)s_name_trgm ON %(table)s USING gist (name gist_trgm_ops);
+    END IF;
+END
+$$
+''')
+
+event.listen(db.metadata, 'before_create', CREATE_TRIGRAM.execute_if(dialect='postgresql'))
+
+
+def has_extension(name):
+    statement = text('SELECT 1 FROM pg_extension WHERE extname = :name')
+
+    return db.session.execute(statement, {'name': name}).scalar() is not None
+
+
+'''
+Sync position
+Each row carries the id of the transaction that last wrote it, and
+each tombstone the id of the one that deleted it. Readers page by
+that id, below the xmin of their snapshot: every transaction with a
+smaller id has finished, so nothing can later commit behind a cursor.
+updated_at, the writer's start time, gives no such guarantee.
+Transactions that only read take no id and never hold the bound back.
+txid_current() is the bigint form of pg_current_xact_id()
+
+'''
+SYNC_BOUND = text('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+
+
+def sync_bound():
+    return db.session.execute(SYNC_BOUND).scalar()
+
+
+def table_versions(tables):
+    selection = db.session.query(TableVersion.name, TableVersion.version) \
+        .filter(TableVersion.name.in_(tables))
+    versions = dict(selection)
+
+    return [versions.get(name, 0) for name in tables]
+
+
 '''
 Movies
 
@@ -55,11 +527,20 @@ Movies
 
 class Movie(db.Model):
     __tablename__ = 'movies'
+    __table_args__ = (
+        Index('ix_movies_updated_at', 'updated_at', 'id'),
+        Index('ix_movies_changed_xid', 'changed_xid', 'id'),
+        Index('ix_movies_year', 'year', 'id'),
+        Index('ix_movies_name', 'name', 'id')
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     year = Column(Integer, nullable=False)
-    casting = db.relationship('Cast', backref=db.backref('movies'), cascade='all, delete-orphan', lazy=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    changed_xid = Column(BigInteger, nullable=False, server_default=func.txid_current(), onupdate=func.txid_current())
+    casting = db.relationship('Cast', backref=db.backref('movies'), cascade='all, delete-orphan', passive_deletes=True, lazy=True)
 
     def __init__(self, name, year):
         self.name = name
@@ -67,22 +548,28 @@ class Movie(db.Model):
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        save()
 
     def update(self):
-        db.session.commit()
+        save()
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        save()
 
-    def format(self):
-        return {
+    def format(self, cast=False):
+        movie = {
             'id': self.id,
             'name': self.name,
             'release': self.year
         }
 
+        if cast:
+            castings = sorted(self.casting, key=lambda casting: casting.actor_id)
+            movie['cast'] = [casting.actors.format() for casting in castings]
+
+        return movie
+
 
 '''
 Actors
@@ -92,12 +579,22 @@ Actors
 
 class Actor(db.Model):
     __tablename__ = 'actors'
+    __table_args__ = (
+        Index('ix_actors_updated_at', 'updated_at', 'id'),
+        Index('ix_actors_changed_xid', 'changed_xid', 'id'),
+        Index('ix_actors_age', 'age', 'id'),
+        Index('ix_actors_gender_age', 'gender', 'age', 'id'),
+        Index('ix_actors_name', 'name', 'id')
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     age = Column(Integer, nullable=False)
     gender = Column(String(1), nullable=False)
-    casting = db.relationship('Cast', backref=db.backref('actors'), cascade='all, delete-orphan', lazy=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    changed_xid = Column(BigInteger, nullable=False, server_default=func.txid_current(), onupdate=func.txid_current())
+    casting = db.relationship('Cast', backref=db.backref('actors'), cascade='all, delete-orphan', passive_deletes=True, lazy=True)
 
     def __init__(self, name, age, gender):
         self.name = name
@@ -106,23 +603,29 @@ class Actor(db.Model):
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        save()
 
     def update(self):
-        db.session.commit()
+        save()
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        save()
 
-    def format(self):
-        return {
+    def format(self, cast=False):
+        actor = {
             'id': self.id,
             'name': self.name,
             'age': self.age,
             'gender': self.gender
         }
 
+        if cast:
+            castings = sorted(self.casting, key=lambda casting: casting.movie_id)
+            actor['movies'] = [casting.movies.format() for casting in castings]
+
+        return actor
+
 
 '''
 Casts
@@ -132,11 +635,18 @@ Relationship between Movies and Actors
 
 class Cast(db.Model):
     __tablename__ = 'casts'
-    __table_args__ = (UniqueConstraint('movie_id', 'actor_id'), )
+    __table_args__ = (
+        UniqueConstraint('movie_id', 'actor_id'),
+        Index('ix_casts_updated_at', 'updated_at', 'id'),
+        Index('ix_casts_changed_xid', 'changed_xid', 'id')
+    )
 
     id = Column(Integer, primary_key=True)
-    movie_id = Column(Integer, ForeignKey('movies.id'), nullable=False)
-    actor_id = Column(Integer, ForeignKey('actors.id'), nullable=False)
+    movie_id = Column(Integer, ForeignKey('movies.id', ondelete='CASCADE'), nullable=False)
+    actor_id = Column(Integer, ForeignKey('actors.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    changed_xid = Column(BigInteger, nullable=False, server_default=func.txid_current(), onupdate=func.txid_current())
 
     def __init__(self, movie_id, actor_id):
         self.movie_id = movie_id
@@ -144,17 +654,190 @@ class Cast(db.Model):
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        save()
 
     def update(self):
-        db.session.commit()
+        save()
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        save()
 
     def format(self):
         return {
             'movie_id': self.movie_id,
             'actor_id': self.actor_id
         }
+
+
+'''
+Tombstones
+Deleted rows leave their id behind, written by a row trigger
+so cascaded deletes are kept too, for ?since= sync clients
+
+'''
+
+
+class Tombstone(db.Model):
+    __tablename__ = 'tombstones'
+    __table_args__ = (
+        Index('ix_tombstones_deleted_at', 'table_name', 'deleted_at', 'row_id'),
+        Index('ix_tombstones_deleted_xid', 'table_name', 'deleted_xid', 'row_id')
+    )
+
+    id = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    deleted_xid = Column(BigInteger, nullable=False, server_default=func.txid_current())
+
+
+RECORD_TOMBSTONE = DDL('''
+CREATE OR REPLACE FUNCTION record_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO tombstones (table_name, row_id) VALUES (TG_TABLE_NAME, OLD.id);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+''')
+
+DROP_RECORD_TOMBSTONE = DDL('DROP FUNCTION IF EXISTS record_tombstone()')
+
+TOMBSTONE_TRIGGER = DDL('''
+CREATE TRIGGER %(table)s_tombstone
+AFTER DELETE ON %(table)s
+FOR EACH ROW EXECUTE PROCEDURE record_tombstone()
+''')
+
+event.listen(db.metadata, 'before_create', RECORD_TOMBSTONE.execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'after_drop', DROP_RECORD_TOMBSTONE.execute_if(dialect='postgresql'))
+
+
+'''
+Catalog statistics
+A one row materialized view with the aggregates of the catalog and
+the table versions they were computed from. Reading it costs the
+same for any catalog size, refreshing it reads every row, so only
+one worker at a time does it, under an advisory lock
+
+'''
+
+STATS_TABLES = ['actors', 'movies', 'casts']
+STATS_LOCK = 5743001
+
+CREATE_CATALOG_STATS = DDL('''
+CREATE MATERIALIZED VIEW catalog_stats AS
+SELECT
+    1 AS id,
+    now() AS refreshed_at,
+    (SELECT count(*) FROM movies) AS movies,
+    (SELECT count(*) FROM actors) AS actors,
+    (SELECT count(*) FROM casts) AS casts,
+    (
+        SELECT coalesce(jsonb_object_agg(year, total), '{}')
+        FROM (SELECT year, count(*) AS total FROM movies GROUP BY year) AS years
+    ) AS movies_per_year,
+    (
+        SELECT coalesce(jsonb_object_agg(age_group, total), '{}')
+        FROM (SELECT age / 10 * 10 AS age_group, count(*) AS total FROM actors GROUP BY 1) AS ages
+    ) AS actors_per_age_group,
+    (
+        SELECT coalesce(jsonb_object_agg(gender, total), '{}')
+        FROM (SELECT gender, count(*) AS total FROM actors GROUP BY gender) AS genders
+    ) AS actors_per_gender,
+    (
+        SELECT coalesce(round(avg(size), 2), 0)::float8
+        FROM (
+            SELECT count(casts.id) AS size
+            FROM movies LEFT JOIN casts ON casts.movie_id = movies.id
+            GROUP BY movies.id
+        ) AS sizes
+    ) AS average_cast_size,
+    (
+        SELECT jsonb_build_object(
+            'actors', coalesce(max(version) FILTER (WHERE name = 'actors'), 0),
+            'movies', coalesce(max(version) FILTER (WHERE name = 'movies'), 0),
+            'casts', coalesce(max(version) FILTER (WHERE name = 'casts'), 0)
+        )
+        FROM table_versions
+    ) AS versions;
+
+CREATE UNIQUE INDEX ix_catalog_stats_id ON catalog_stats (id)
+''')
+
+DROP_CATALOG_STATS = DDL('DROP MATERIALIZED VIEW IF EXISTS catalog_stats')
+
+event.listen(db.metadata, 'after_create', CREATE_CATALOG_STATS.execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'before_drop', DROP_CATALOG_STATS.execute_if(dialect='postgresql'))
+
+
+def catalog_stats():
+    return db.session.execute(text('SELECT * FROM catalog_stats')).mappings().one()
+
+
+def refresh_catalog_stats():
+    # Its own transaction on the primary, even when the request reads from a replica
+    with db.engine.begin() as connection:
+        locked = connection.execute(text('SELECT pg_try_advisory_xact_lock(:key)'), {'key': STATS_LOCK}).scalar()
+
+        # Someone else is refreshing, the current row is good enough until they are done
+        if locked:
+            connection.execute(text('REFRESH MATERIALIZED VIEW CONCURRENTLY catalog_stats'))
+
+    return locked
+
+
+'''
+Projections
+Read-only paths select just the columns of the response as plain
+rows and zip them into dicts, without building ORM objects, filling
+the identity map or tracking changes. Fields are named as in the
+responses, 'year' being accepted for a movie's 'release'
+
+'''
+
+FIELDS = {
+    Movie: {'id': Movie.id, 'name': Movie.name, 'release': Movie.year},
+    Actor: {'id': Actor.id, 'name': Actor.name, 'age': Actor.age, 'gender': Actor.gender},
+    Cast: {'movie_id': Cast.movie_id, 'actor_id': Cast.actor_id}
+}
+
+
+def parse_fields(model, requested):
+    fields = FIELDS[model]
+    aliases = {column.key: name for name, column in fields.items()}
+    names = ['id'] if 'id' in fields else []
+
+    for name in requested:
+        name = aliases.get(name.strip(), name.strip())
+
+        if name not in fields:
+            raise ValueError('Unknown field %s' % name)
+
+        if name not in names:
+            names.append(name)
+
+    return names
+
+
+def project(model, names, extra=()):
+    columns = [FIELDS[model][name] for name in names]
+    keys = set(column.key for column in columns)
+
+    # Columns needed by the caller, such as a cursor's sort key, go after the fields
+    columns.extend(column for column in extra if column.key not in keys)
+
+    return db.session.query(*columns)
+
+
+'''
+Version, tombstone and name search DDL for the tables above
+
+'''
+
+for versioned in (Movie, Actor, Cast):
+    event.listen(versioned.__table__, 'after_create', VERSION_TRIGGER.execute_if(dialect='postgresql'))
+    event.listen(versioned.__table__, 'after_create', TOMBSTONE_TRIGGER.execute_if(dialect='postgresql'))
+
+for searchable in (Movie, Actor):
+    event.listen(searchable.__table__, 'after_create', TRIGRAM_INDEX.execute_if(dialect='postgresql'))
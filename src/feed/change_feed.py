@@ -0,0 +1,252 @@
+import os
+import json
+import queue
+import select
+import logging
+import secrets
+import threading
+from collections import deque
+import psycopg2
+from sqlalchemy.engine import make_url
+
+
+FEED_BROKER = os.environ.get('FEED_BROKER', 'memory')
+FEED_HISTORY = int(os.environ.get('FEED_HISTORY', 1000))
+FEED_CLIENT_BUFFER = int(os.environ.get('FEED_CLIENT_BUFFER', 100))
+FEED_MAX_SUBSCRIBERS = int(os.environ.get('FEED_MAX_SUBSCRIBERS', 100))
+FEED_MAX_IDS = int(os.environ.get('FEED_MAX_IDS', 500))
+FEED_HEARTBEAT = int(os.environ.get('FEED_HEARTBEAT', 15))
+FEED_CHANNEL = 'changes'
+
+logger = logging.getLogger(__name__)
+
+'''
+Subscriber
+One client of the stream, with a bounded buffer. A client
+that lets it fill up is closed and has to resume by id
+
+'''
+
+
+class Subscriber:
+    def __init__(self, buffer_size, backlog=()):
+        self.queue = queue.Queue(maxsize=buffer_size + len(backlog))
+        self.closed = False
+
+        for event in backlog:
+            self.queue.put_nowait(event)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+
+        except queue.Full:
+            self.closed = True
+
+        return not self.closed
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+
+        except queue.Empty:
+            return None
+
+
+'''
+Change Feed
+Fans committed changes out to every subscriber of this worker
+and keeps the last FEED_HISTORY events so clients can resume
+from Last-Event-ID. With a broker, events go through Postgres
+LISTEN/NOTIFY first so every worker sees every write
+
+'''
+
+
+class ChangeFeed:
+    def __init__(self, history=FEED_HISTORY, buffer_size=FEED_CLIENT_BUFFER,
+                 max_subscribers=FEED_MAX_SUBSCRIBERS, max_ids=FEED_MAX_IDS):
+        self.history = deque(maxlen=history)
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.max_ids = max_ids
+        self.subscribers = set()
+        self.broker = None
+        self.delivered = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def events(self, changes):
+        merged = {}
+
+        for table, op, ids in changes:
+            key = (table, op)
+
+            # Unknown rows win over any id list for the same table and op
+            if ids is None or merged.get(key, []) is None:
+                merged[key] = None
+
+            else:
+                merged.setdefault(key, []).extend(ids)
+
+        for (table, op), ids in merged.items():
+            ids = None if ids is None else sorted(set(ids))
+            chunks = [None] if ids is None else [ids[start:start + self.max_ids] for start in range(0, len(ids), self.max_ids)]
+
+            for chunk in chunks:
+                yield {
+                    'id': secrets.token_hex(8),
+                    'type': 'change',
+                    'data': {'table': table, 'op': op, 'ids': chunk}
+                }
+
+    def publish(self, changes):
+        events = list(self.events(changes))
+
+        if not events:
+            return
+
+        if self.broker is not None:
+            self.broker.publish(events)
+
+        else:
+            for event in events:
+                self.deliver(event)
+
+    def deliver(self, event):
+        with self._lock:
+            self.history.append(event)
+            self.delivered += 1
+
+            for subscriber in list(self.subscribers):
+                if not subscriber.put(event):
+                    self.subscribers.discard(subscriber)
+                    self.dropped += 1
+
+    def subscribe(self, last_event_id=None):
+        with self._lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+
+            backlog = []
+
+            if last_event_id:
+                ids = [event['id'] for event in self.history]
+
+                if last_event_id in ids:
+                    backlog = list(self.history)[ids.index(last_event_id) + 1:]
+
+                else:
+                    # Too old or from before a restart, the client has to resync
+                    backlog = [{'id': None, 'type': 'reset', 'data': {}}]
+
+            subscriber = Subscriber(self.buffer_size, backlog)
+            self.subscribers.add(subscriber)
+
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def start(self, database_path, broker=FEED_BROKER):
+        if broker == 'postgres' and self.broker is None:
+            self.broker = PostgresBroker(database_path)
+            self.broker.start(self.deliver)
+
+    def stats(self):
+        return {
+            'broker': 'postgres' if self.broker else 'memory',
+            'subscribers': len(self.subscribers),
+            'history': len(self.history),
+            'delivered': self.delivered,
+            'dropped': self.dropped
+        }
+
+
+'''
+Postgres broker
+NOTIFY on publish and one LISTEN connection per worker,
+reconnecting when the connection is lost
+
+'''
+
+
+class PostgresBroker:
+    def __init__(self, database_path, channel=FEED_CHANNEL):
+        self.dsn = make_url(database_path).set(drivername='postgresql').render_as_string(hide_password=False)
+        self.channel = channel
+        self.connection = None
+        self._lock = threading.Lock()
+        self.listening = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def connect(self):
+        return psycopg2.connect(self.dsn)
+
+    def publish(self, events):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self.connection is None or self.connection.closed:
+                        self.connection = self.connect()
+
+                    # One transaction, so every listener gets them together and in order
+                    with self.connection, self.connection.cursor() as cursor:
+                        for event in events:
+                            cursor.execute('SELECT pg_notify(%s, %s)', (self.channel, json.dumps(event)))
+
+                    return
+
+                except psycopg2.Error:
+                    logger.exception('Change feed publish failed')
+                    self.connection = None
+
+    def listen(self, deliver):
+        while not self._stop.is_set():
+            connection = None
+
+            try:
+                connection = self.connect()
+                connection.autocommit = True
+
+                with connection.cursor() as cursor:
+                    cursor.execute('LISTEN %s' % self.channel)
+
+                self.listening.set()
+
+                while not self._stop.is_set():
+                    if select.select([connection], [], [], 1)[0]:
+                        connection.poll()
+
+                        while connection.notifies:
+                            deliver(json.loads(connection.notifies.pop(0).payload))
+
+            except psycopg2.Error:
+                logger.exception('Change feed listener disconnected')
+                self._stop.wait(1)
+
+            finally:
+                self.listening.clear()
+
+                if connection is not None:
+                    connection.close()
+
+    def start(self, deliver):
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.listen, args=(deliver,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+change_feed = ChangeFeed()
@@ -0,0 +1,98 @@
+import os
+import unittest
+from .change_feed import ChangeFeed
+
+
+class ChangeFeedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.feed = ChangeFeed(history=3, buffer_size=2, max_subscribers=3, max_ids=2)
+
+    def testFanOut(self):
+        subscribers = [self.feed.subscribe() for _ in range(3)]
+        self.feed.publish([('actors', 'insert', [1])])
+
+        for subscriber in subscribers:
+            event = subscriber.get(0)
+            self.assertEqual(event['data'], {'table': 'actors', 'op': 'insert', 'ids': [1]})
+
+    def testMergedAndChunked(self):
+        events = list(self.feed.events([
+            ('actors', 'insert', [3]),
+            ('actors', 'insert', [1, 2]),
+            ('casts', 'delete', [4]),
+            ('casts', 'delete', None)
+        ]))
+
+        self.assertEqual([event['data'] for event in events], [
+            {'table': 'actors', 'op': 'insert', 'ids': [1, 2]},
+            {'table': 'actors', 'op': 'insert', 'ids': [3]},
+            {'table': 'casts', 'op': 'delete', 'ids': None}
+        ])
+        self.assertEqual(len(set(event['id'] for event in events)), 3)
+
+    def testResume(self):
+        self.feed.publish([('actors', 'insert', [1])])
+        last_event_id = self.feed.history[-1]['id']
+        self.feed.publish([('actors', 'update', [1])])
+        subscriber = self.feed.subscribe(last_event_id)
+
+        self.assertEqual(subscriber.get(0)['data']['op'], 'update')
+        self.assertIsNone(subscriber.get(0))
+
+    def testResumeFromUnknownId(self):
+        subscriber = self.feed.subscribe('gone')
+
+        self.assertEqual(subscriber.get(0)['type'], 'reset')
+
+    def testHistoryBounded(self):
+        for actor_id in range(5):
+            self.feed.publish([('actors', 'insert', [actor_id])])
+
+        self.assertEqual(len(self.feed.history), 3)
+
+    def testSlowConsumerDropped(self):
+        slow = self.feed.subscribe()
+        fast = self.feed.subscribe()
+
+        for actor_id in range(3):
+            self.feed.publish([('actors', 'insert', [actor_id])])
+            fast.get(0)
+
+        self.assertTrue(slow.closed)
+        self.assertFalse(fast.closed)
+        self.assertEqual(self.feed.stats()['subscribers'], 1)
+        self.assertEqual(self.feed.stats()['dropped'], 1)
+
+    def testMaxSubscribers(self):
+        for _ in range(3):
+            self.assertIsNotNone(self.feed.subscribe())
+
+        self.assertIsNone(self.feed.subscribe())
+
+
+@unittest.skipUnless(os.environ.get('DATABASE_URL', '').startswith('postgres'), 'needs Postgres')
+class PostgresBrokerTestCase(unittest.TestCase):
+    def testFanOutAcrossWorkers(self):
+        database_path = os.environ['DATABASE_URL'].replace('postgres://', 'postgresql://', 1)
+        workers = [ChangeFeed(), ChangeFeed()]
+
+        for worker in workers:
+            worker.start(database_path, broker='postgres')
+            self.addCleanup(worker.broker.stop)
+
+        subscribers = [worker.subscribe() for worker in workers]
+
+        for worker in workers:
+            self.assertTrue(worker.broker.listening.wait(5))
+
+        workers[0].publish([('movies', 'update', [1])])
+
+        events = [subscriber.get(5) for subscriber in subscribers]
+
+        self.assertTrue(all(event is not None for event in events))
+        self.assertEqual(events[0]['id'], events[1]['id'])
+        self.assertEqual(events[1]['data'], {'table': 'movies', 'op': 'update', 'ids': [1]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import time
+from ..database.mirror import TableMirror
+
+'''
+Cast Graph
+The actor-movie graph of the casts table as two adjacency maps.
+Paths between actors are found with a bidirectional breadth-first
+search that always grows the smaller side, so a six degree search
+visits a few thousand actors instead of the whole graph
+
+'''
+
+
+def chain(node, parents):
+    nodes = [node]
+
+    while parents[node] is not None:
+        node, movie_id = parents[node]
+        nodes.extend([movie_id, node])
+
+    return nodes
+
+
+class CastGraph:
+    def __init__(self):
+        self.casts = {}
+        self.movies = {}
+        self.actors = {}
+
+    def __len__(self):
+        return len(self.casts)
+
+    def add(self, cast_id, movie_id, actor_id):
+        if cast_id in self.casts:
+            self.remove(cast_id)
+
+        self.casts[cast_id] = (movie_id, actor_id)
+        self.movies.setdefault(actor_id, set()).add(movie_id)
+        self.actors.setdefault(movie_id, set()).add(actor_id)
+
+    def remove(self, cast_id):
+        edge = self.casts.pop(cast_id, None)
+
+        if edge is None:
+            return
+
+        movie_id, actor_id = edge
+        self.movies[actor_id].discard(movie_id)
+        self.actors[movie_id].discard(actor_id)
+
+        if not self.movies[actor_id]:
+            del self.movies[actor_id]
+
+        if not self.actors[movie_id]:
+            del self.actors[movie_id]
+
+    def load(self, rows):
+        self.casts = {}
+        self.movies = {}
+        self.actors = {}
+
+        for cast_id, movie_id, actor_id in rows:
+            self.add(cast_id, movie_id, actor_id)
+
+    # Alternating actor and movie ids from source to target, and
+    # whether a limit stopped the search before it was exhausted
+    def path(self, source, target, max_depth, deadline):
+        if source == target:
+            return [source], False
+
+        parents = [{source: None}, {target: None}]
+        frontiers = [[source], [target]]
+        depth = 0
+
+        while frontiers[0] and frontiers[1]:
+            if depth >= max_depth:
+                return None, True
+
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            seen, other = parents[side], parents[1 - side]
+            frontier = []
+
+            for actor_id in frontiers[side]:
+                if time.monotonic() > deadline:
+                    return None, True
+
+                for movie_id in self.movies.get(actor_id, ()):
+                    for costar_id in self.actors[movie_id]:
+                        if costar_id in seen:
+                            continue
+
+                        seen[costar_id] = (actor_id, movie_id)
+
+                        if costar_id in other:
+                            return chain(costar_id, parents[0])[::-1] + chain(costar_id, parents[1])[1:], False
+
+                        frontier.append(costar_id)
+
+            frontiers[side] = frontier
+            depth += 1
+
+        return None, False
+
+
+'''
+Table Cast Graph
+A CastGraph mirroring the casts table. Cast rows are never updated,
+and deleted ones, cascades included, come back as tombstones
+
+'''
+
+
+class TableCastGraph(TableMirror):
+    def __init__(self, model):
+        super().__init__(model, ['id', 'movie_id', 'actor_id'])
+        self.graph = CastGraph()
+
+    def load(self, rows):
+        self.graph.load((row.id, row.movie_id, row.actor_id) for row in rows)
+
+    def apply(self, rows, deleted_ids):
+        for row in rows:
+            self.graph.add(row.id, row.movie_id, row.actor_id)
+
+        for cast_id in deleted_ids:
+            self.graph.remove(cast_id)
+
+    def path(self, source, target, max_depth, timeout):
+        with self._lock:
+            self.refresh()
+
+            return self.graph.path(source, target, max_depth, time.monotonic() + timeout)
+
+    def stats(self):
+        return {
+            'casts': len(self.graph),
+            'actors': len(self.graph.movies),
+            'movies': len(self.graph.actors),
+            'version': self.version
+        }
@@ -0,0 +1,55 @@
+import time
+import unittest
+from .costar_graph import CastGraph
+
+
+class CastGraphTestCase(unittest.TestCase):
+    def setUp(self):
+        self.graph = CastGraph()
+        self.graph.load([
+            (1, 10, 1),
+            (2, 10, 2),
+            (3, 20, 2),
+            (4, 20, 3),
+            (5, 30, 3),
+            (6, 30, 4),
+            (7, 40, 5)
+        ])
+
+    def path(self, source, target, max_depth=6):
+        return self.graph.path(source, target, max_depth, time.monotonic() + 5)
+
+    def testPath(self):
+        self.assertEqual(self.path(1, 4), ([1, 10, 2, 20, 3, 30, 4], False))
+        self.assertEqual(self.path(4, 1), ([4, 30, 3, 20, 2, 10, 1], False))
+
+    def testSameActor(self):
+        self.assertEqual(self.path(1, 1), ([1], False))
+
+    def testNotConnected(self):
+        self.assertEqual(self.path(1, 5), (None, False))
+        self.assertEqual(self.path(1, 99), (None, False))
+
+    def testShortest(self):
+        self.graph.add(8, 50, 1)
+        self.graph.add(9, 50, 4)
+
+        self.assertEqual(self.path(1, 4), ([1, 50, 4], False))
+
+    def testDepthLimit(self):
+        self.assertEqual(self.path(1, 4, max_depth=2), (None, True))
+        self.assertEqual(self.path(1, 4, max_depth=3)[0], [1, 10, 2, 20, 3, 30, 4])
+
+    def testTimeLimit(self):
+        self.assertEqual(self.graph.path(1, 4, 6, time.monotonic() - 1), (None, True))
+
+    def testRemove(self):
+        self.graph.remove(4)
+
+        self.assertEqual(self.path(1, 4), (None, False))
+        self.assertEqual(self.graph.actors[20], {2})
+        self.assertEqual(len(self.graph), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+import re
+import bisect
+from collections import Counter
+from ..database.mirror import TableMirror
+
+
+PREFIX_CANDIDATES = 1000
+WORD_SIMILARITY = 0.6
+
+'''
+Name Index
+In-process stand-in for pg_trgm: a sorted word list for prefix
+lookups and an inverted trigram index for fuzzy matches, ranked
+the way word_similarity() ranks them
+
+'''
+
+
+def words(text):
+    return [word for word in re.split(r'[^0-9a-z]+', text.lower()) if word]
+
+
+def trigrams(text):
+    found = set()
+
+    for word in words(text):
+        padded = '  ' + word + ' '
+        found.update(padded[start:start + 3] for start in range(len(padded) - 2))
+
+    return found
+
+
+class NameIndex:
+    def __init__(self):
+        self.names = {}
+        self.words = []
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, row_id, name):
+        if row_id in self.names:
+            self.remove(row_id)
+
+        self.names[row_id] = name
+
+        for word in set(words(name)):
+            bisect.insort(self.words, (word, row_id))
+
+        for trigram in trigrams(name):
+            self.postings.setdefault(trigram, set()).add(row_id)
+
+    def remove(self, row_id):
+        name = self.names.pop(row_id, None)
+
+        if name is None:
+            return
+
+        for word in set(words(name)):
+            position = bisect.bisect_left(self.words, (word, row_id))
+
+            if position < len(self.words) and self.words[position] == (word, row_id):
+                del self.words[position]
+
+        for trigram in trigrams(name):
+            postings = self.postings.get(trigram)
+
+            if postings is not None:
+                postings.discard(row_id)
+
+                if not postings:
+                    del self.postings[trigram]
+
+    def load(self, rows):
+        self.names = dict(rows)
+        self.words = sorted((word, row_id) for row_id, name in self.names.items() for word in set(words(name)))
+        self.postings = {}
+
+        for row_id, name in self.names.items():
+            for trigram in trigrams(name):
+                self.postings.setdefault(trigram, set()).add(row_id)
+
+    def prefix(self, query, limit):
+        query_words = words(query)
+
+        if not query_words:
+            return []
+
+        last = query_words[-1]
+        position = bisect.bisect_left(self.words, (last, -1))
+        candidates = []
+
+        while position < len(self.words) and len(candidates) < PREFIX_CANDIDATES:
+            word, row_id = self.words[position]
+
+            if not word.startswith(last):
+                break
+
+            candidates.append(row_id)
+            position += 1
+
+        needle = ' '.join(query_words)
+        matches = {}
+
+        for row_id in set(candidates):
+            name = ' '.join(words(self.names[row_id]))
+
+            # Every query word has to start a word of the name, in order
+            if (' ' + name).find(' ' + needle) >= 0:
+                matches[row_id] = (not name.startswith(needle), len(name), row_id)
+
+        return sorted(matches, key=matches.get)[:limit]
+
+    def fuzzy(self, query, limit):
+        query_trigrams = trigrams(query)
+
+        if not query_trigrams:
+            return []
+
+        shared = Counter()
+
+        for trigram in query_trigrams:
+            shared.update(self.postings.get(trigram, ()))
+
+        scores = {
+            row_id: count / len(query_trigrams)
+            for row_id, count in shared.items()
+            if count / len(query_trigrams) >= WORD_SIMILARITY
+        }
+
+        return sorted(scores, key=lambda row_id: (-scores[row_id], len(self.names[row_id]), row_id))[:limit]
+
+
+'''
+Table Name Index
+A NameIndex mirroring the names of one table
+
+'''
+
+
+class TableNameIndex(TableMirror):
+    def __init__(self, model):
+        super().__init__(model, ['id', 'name'])
+        self.index = NameIndex()
+
+    def load(self, rows):
+        self.index.load((row.id, row.name) for row in rows)
+
+    def apply(self, rows, deleted_ids):
+        for row in rows:
+            self.index.add(row.id, row.name)
+
+        for row_id in deleted_ids:
+            self.index.remove(row_id)
+
+    def search(self, query, prefix, limit):
+        with self._lock:
+            self.refresh()
+
+            if prefix:
+                return self.index.prefix(query, limit)
+
+            return self.index.fuzzy(query, limit)
+
+    def stats(self):
+        return {
+            'rows': len(self.index),
+            'version': self.version
+        }
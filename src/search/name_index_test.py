@@ -0,0 +1,44 @@
+import unittest
+from .name_index import NameIndex, trigrams
+
+
+class NameIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = NameIndex()
+        self.index.load([
+            (1, 'Tom Hanks'),
+            (2, 'Tom Holland'),
+            (3, 'Hank Azaria'),
+            (4, 'Sandra Bullock'),
+            (5, 'Thomas Hanks-Smith')
+        ])
+
+    def testTrigrams(self):
+        self.assertEqual(trigrams('Tom'), {'  t', ' to', 'tom', 'om '})
+
+    def testPrefix(self):
+        self.assertEqual(self.index.prefix('tom h', 10), [1, 2])
+        self.assertEqual(self.index.prefix('han', 10), [3, 1, 5])
+        self.assertEqual(self.index.prefix('zzz', 10), [])
+
+    def testPrefixLimit(self):
+        self.assertEqual(self.index.prefix('t', 2), [1, 2])
+
+    def testFuzzy(self):
+        self.assertEqual(self.index.fuzzy('hanks', 10)[:2], [1, 5])
+        self.assertIn(4, self.index.fuzzy('bulock', 10))
+        self.assertEqual(self.index.fuzzy('xyz', 10), [])
+
+    def testAddAndRemove(self):
+        self.index.add(6, 'Tom Cruise')
+        self.index.remove(1)
+        self.index.add(2, 'Zendaya')
+
+        self.assertEqual(self.index.prefix('tom', 10), [6])
+        self.assertEqual(self.index.prefix('zen', 10), [2])
+        self.assertNotIn(1, self.index.fuzzy('hanks', 10))
+        self.assertEqual(len(self.index), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
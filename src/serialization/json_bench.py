@@ -0,0 +1,74 @@
+import sys
+import timeit
+from .json_provider import Fragment, StdlibProvider, OrjsonProvider
+
+'''
+JSON micro-benchmark
+Encodes list responses shaped like GET /actors?include=cast with
+each provider and prints the time per response and the speedup.
+Run from the repository root:
+
+    python -m src.serialization.json_bench [rows ...]
+
+'''
+
+SIZES = [10, 100, 1000, 10000]
+
+
+def movie(movie_id):
+    return {'id': movie_id, 'name': 'Movie number %d' % movie_id, 'release': 1950 + movie_id % 70}
+
+
+def actor(actor_id):
+    return {
+        'id': actor_id,
+        'name': 'Actor number %d' % actor_id,
+        'age': 18 + actor_id % 60,
+        'gender': 'mf'[actor_id % 2],
+        'movies': [movie(actor_id * 3 + offset) for offset in range(3)]
+    }
+
+
+def payload(rows):
+    return {'success': True, 'actors': [actor(actor_id) for actor_id in range(rows)], 'total_actors': rows}
+
+
+def fragments(provider, rows):
+    # The same list with every actor already rendered, as a row cache would keep them
+    return {'success': True, 'actors': [Fragment(provider.dumps(actor(actor_id))) for actor_id in range(rows)], 'total_actors': rows}
+
+
+def measure(function, budget=0.5):
+    runs, elapsed = timeit.Timer(function).autorange()
+    runs = max(1, int(runs * budget / max(elapsed, 1e-9)))
+
+    return min(timeit.Timer(function).repeat(3, runs)) / runs
+
+
+def main(sizes):
+    providers = [StdlibProvider()]
+
+    try:
+        providers.append(OrjsonProvider())
+
+    except ImportError:
+        print('orjson is not installed, only the standard library is measured')
+
+    print('%8s %10s %12s %12s %12s' % ('rows', 'bytes', 'provider', 'ms', 'fragments ms'))
+
+    for rows in sizes:
+        document = payload(rows)
+        baseline = None
+
+        for provider in providers:
+            rendered = fragments(provider, rows)
+            plain = measure(lambda: provider.dumps(document)) * 1000
+            spliced = measure(lambda: provider.dumps(rendered)) * 1000
+            baseline = baseline or plain
+            speedup = '' if plain == baseline else '  %.1fx' % (baseline / plain)
+
+            print('%8d %10d %12s %12.3f %12.3f%s' % (rows, len(provider.dumps(document)), provider.name, plain, spliced, speedup))
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or SIZES)
@@ -0,0 +1,113 @@
+import os
+import re
+import json
+import secrets
+from flask import current_app
+
+
+JSON_PROVIDER = os.environ.get('JSON_PROVIDER', 'auto')
+
+'''
+Fragments
+JSON that is already serialized, such as bytes kept by a cache,
+embedded as is in a larger document instead of being parsed and
+encoded again
+
+'''
+
+
+class Fragment:
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data.encode() if isinstance(data, str) else data
+
+
+# Random per process, so no string in a document can pass for a placeholder
+FRAGMENT_TOKEN = 'fragment-%s-' % secrets.token_hex(16)
+FRAGMENT_PATTERN = re.compile(b'"%s([0-9]+)"' % FRAGMENT_TOKEN.encode())
+
+
+class FragmentSplicer:
+    def __init__(self):
+        self.fragments = []
+
+    def default(self, value):
+        if isinstance(value, Fragment):
+            self.fragments.append(value.data)
+
+            return FRAGMENT_TOKEN + str(len(self.fragments) - 1)
+
+        raise TypeError('Object of type %s is not JSON serializable' % type(value).__name__)
+
+    # One pass over the body, however many fragments it holds
+    def splice(self, body):
+        return FRAGMENT_PATTERN.sub(lambda match: self.fragments[int(match.group(1))], body)
+
+
+'''
+Providers
+Both turn a document into compact UTF-8 bytes. orjson is several
+times faster on large lists, the standard library is always there
+
+'''
+
+
+class StdlibProvider:
+    name = 'json'
+
+    def __init__(self, sort_keys=True):
+        self.sort_keys = sort_keys
+
+    def dumps(self, value):
+        splicer = FragmentSplicer()
+        body = json.dumps(value, default=splicer.default, sort_keys=self.sort_keys,
+                          separators=(',', ':'), ensure_ascii=False).encode()
+
+        return splicer.splice(body) if splicer.fragments else body
+
+
+class OrjsonProvider:
+    name = 'orjson'
+
+    def __init__(self, sort_keys=True):
+        # Optional, make_provider falls back to StdlibProvider without it
+        import orjson
+
+        self.orjson = orjson
+        self.option = orjson.OPT_SORT_KEYS if sort_keys else 0
+
+    def dumps(self, value):
+        splicer = FragmentSplicer()
+        body = self.orjson.dumps(value, default=splicer.default, option=self.option)
+
+        return splicer.splice(body) if splicer.fragments else body
+
+
+def make_provider(name=JSON_PROVIDER, sort_keys=True):
+    if name in ('auto', 'orjson'):
+        try:
+            return OrjsonProvider(sort_keys)
+
+        except ImportError:
+            if name == 'orjson':
+                raise
+
+    return StdlibProvider(sort_keys)
+
+
+'''
+jsonify
+Drop-in for flask.jsonify using the provider of the current app
+
+'''
+
+
+def jsonify(*args, **kwargs):
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+
+    data = args[0] if len(args) == 1 else args or kwargs
+    provider = current_app.extensions['json_provider']
+
+    return current_app.response_class(provider.dumps(data) + b'\n', mimetype='application/json')
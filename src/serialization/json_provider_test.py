@@ -0,0 +1,78 @@
+import sys
+import json
+import unittest
+from unittest import mock
+from flask import Flask
+from .json_provider import Fragment, StdlibProvider, OrjsonProvider, make_provider, jsonify
+
+
+DOCUMENT = {
+    'success': True,
+    'actors': [{'id': 1, 'name': 'Zoë Saldaña', 'age': 44, 'gender': 'f', 'movies': []}],
+    'next_cursor': None,
+    'ratio': 0.5
+}
+
+
+class ProviderTestCase(unittest.TestCase):
+    def providers(self):
+        providers = [StdlibProvider()]
+
+        try:
+            providers.append(OrjsonProvider())
+
+        except ImportError:
+            pass
+
+        return providers
+
+    def testSameOutput(self):
+        outputs = set(provider.dumps(DOCUMENT) for provider in self.providers())
+
+        self.assertEqual(len(outputs), 1)
+        self.assertEqual(json.loads(outputs.pop()), DOCUMENT)
+
+    def testSortKeys(self):
+        for provider in self.providers():
+            self.assertEqual(provider.dumps({'b': 1, 'a': 2}), b'{"a":2,"b":1}')
+
+    def testFragments(self):
+        cached = [Fragment(b'{"id":%d}' % row_id) for row_id in range(12)]
+
+        for provider in self.providers():
+            body = provider.dumps({'actors': cached, 'name': 'fragment'})
+
+            self.assertEqual(json.loads(body), {'actors': [{'id': row_id} for row_id in range(12)], 'name': 'fragment'})
+
+    def testUnknownType(self):
+        for provider in self.providers():
+            self.assertRaises(TypeError, provider.dumps, {'value': object()})
+
+    def testFallback(self):
+        with mock.patch.dict(sys.modules, {'orjson': None}):
+            self.assertEqual(make_provider('auto').name, 'json')
+            self.assertRaises(ImportError, make_provider, 'orjson')
+
+        self.assertEqual(make_provider('json').name, 'json')
+
+
+class JsonifyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.extensions['json_provider'] = StdlibProvider()
+
+    def testResponse(self):
+        with self.app.app_context():
+            response = jsonify({'success': True})
+
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual(response.get_data(), b'{"success":true}\n')
+
+    def testArguments(self):
+        with self.app.app_context():
+            self.assertEqual(json.loads(jsonify(1, 2).get_data()), [1, 2])
+            self.assertEqual(json.loads(jsonify(success=True).get_data()), {'success': True})
+
+
+if __name__ == "__main__":
+    unittest.main()